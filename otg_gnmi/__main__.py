@@ -41,6 +41,102 @@ if __name__ == '__main__':
                         help='path to certificate key, default is server.crt',
                         default='server.crt',
                         type=str)
+    parser.add_argument('--log-level',
+                        help='server log level',
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='info',
+                        type=str)
+    parser.add_argument('--response-log-level',
+                        help='level at which Subscribe responses are logged',
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='debug',
+                        type=str)
+    parser.add_argument('--response-log-sample',
+                        help='log only 1 in N Subscribe responses',
+                        default=1,
+                        type=int)
+    parser.add_argument('--response-log-summary',
+                        help='log a per path summary of responses every N '
+                             'seconds instead of the responses themselves',
+                        default=0,
+                        type=float)
+    parser.add_argument('--batch-updates',
+                        help='pack all updates of a sample into one '
+                             'notification per session',
+                        action='store_true')
+    parser.add_argument('--max-notification-size',
+                        help='max size in bytes of a batched notification',
+                        default=4*1024*1024,
+                        type=int)
+    parser.add_argument('--session-queue-size',
+                        help='max pending samples per path of a client '
+                             'session',
+                        default=1000,
+                        type=int)
+    parser.add_argument('--slow-consumer-policy',
+                        help='what to do when a session queue is full',
+                        choices=['coalesce', 'drop-oldest', 'disconnect'],
+                        default='coalesce',
+                        type=str)
+    parser.add_argument('--get-max-staleness',
+                        help='max age in seconds of a cached sample '
+                             'served by Get or a ONCE subscription',
+                        default=1.0,
+                        type=float)
+    parser.add_argument('--collector-workers',
+                        help='max concurrent backend fetches',
+                        default=4,
+                        type=int)
+    parser.add_argument('--min-poll-interval',
+                        help='floor in seconds of the adaptive interval '
+                             'of target defined subscriptions',
+                        default=0.05,
+                        type=float)
+    parser.add_argument('--max-poll-interval',
+                        help='ceiling in seconds of the adaptive interval '
+                             'of target defined subscriptions',
+                        default=4.0,
+                        type=float)
+    parser.add_argument('--fetch-chunk-size',
+                        help='max names per backend request, 0 for no limit',
+                        default=1000,
+                        type=int)
+    parser.add_argument('--fetch-max-inflight',
+                        help='max concurrent backend requests for the '
+                             'chunks of large batches',
+                        default=4,
+                        type=int)
+    parser.add_argument('--backend-pool-size',
+                        help='max backend clients, each with its own '
+                             'kept-alive connection',
+                        default=4,
+                        type=int)
+    parser.add_argument('--backend-timeout',
+                        help='timeout in seconds of backend requests, '
+                             '0 for none',
+                        default=30.0,
+                        type=float)
+    parser.add_argument('--leaf-updates',
+                        help='send one typed update per metric leaf '
+                             'instead of the whole metric as one value',
+                        action='store_true')
+    parser.add_argument('--deadband',
+                        help='FIELD=VALUE or FIELD=VALUE%%, smallest change '
+                             'of a metric field sent ON_CHANGE, * for every '
+                             'field, may be repeated',
+                        action='append',
+                        default=[],
+                        type=str)
+    parser.add_argument('--counter-rate-change',
+                        help='send counters ON_CHANGE only when their rate '
+                             'changes',
+                        action='store_true')
+    parser.add_argument('--counter-rate-tolerance',
+                        help='percent by which the rate of a counter '
+                             'without its own dead-band has to change to be '
+                             'sent with --counter-rate-change',
+                        default=5.0,
+                        type=float)
     args = parser.parse_args()
 
     asyncio.run(AsyncServer.run(args))
@@ -1,15 +1,14 @@
 # app_asyncio.py
-import logging
 import signal
 
 import grpc
 import grpc.experimental.aio as grpc_async
 from grpc_reflection.v1alpha import reflection
 
-from .autogen import gnmi_pb2, gnmi_pb2_grpc
+from .autogen import gnmi_pb2
 from .common.ixnutils import TestManager
-from .common.utils import init_logging, get_current_time
-from .gnmi_serv_asyncio import AsyncGnmiService
+from .common.utils import init_logging, get_current_time, get_log_level
+from .gnmi_serv_asyncio import AsyncGnmiService, add_gnmi_servicer_to_server
 
 server = None
 
@@ -27,15 +26,14 @@ class AsyncServer:
             'gnmi',
             'app_asyncio',
             args.logfile,
-            logging.DEBUG,
+            get_log_level(args.log_level),
             log_stdout
         )
         signal.signal(signal.SIGTERM, sighandler)
 
         grpc_async.init_grpc_aio()
         server = grpc.aio.server()
-        gnmi_pb2_grpc.add_gNMIServicer_to_server(
-            AsyncGnmiService(args), server)
+        add_gnmi_servicer_to_server(AsyncGnmiService(args), server)
         SERVICE_NAMES = (
             gnmi_pb2.DESCRIPTOR.services_by_name['gNMI'].full_name,
             reflection.SERVICE_NAME,
@@ -0,0 +1,86 @@
+# api_pool.py
+from contextlib import contextmanager
+from queue import LifoQueue
+from threading import Lock
+
+from requests.adapters import HTTPAdapter
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter applying a default timeout to every request, snappi does
+    not pass any.
+    """
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def set_api_timeout(api, timeout):
+    """Mounts a TimeoutHTTPAdapter on the requests session of a snappi HTTP
+    api. Returns False when the api has no such session (e.g. an extension
+    or a gRPC transport), which is then left untouched.
+    """
+    transport = getattr(api, '_transport', None)
+    session = getattr(transport, '_session', None)
+    if session is None or not hasattr(session, 'mount'):
+        return False
+    # each client is used by one thread at a time, a single kept-alive
+    # connection per host is enough
+    adapter = TimeoutHTTPAdapter(
+        timeout=timeout, pool_connections=1, pool_maxsize=1)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return True
+
+
+class ApiPool(object):
+    """Pool of backend clients, each one keeping its own connection alive.
+
+    Clients are created by `create` on demand, up to `size` of them. A
+    thread takes a client for the duration of a request and waits when all
+    of them are busy, so requests of independent metric kinds go out in
+    parallel without ever sharing a connection.
+    """
+
+    def __init__(self, create, size):
+        self.create = create
+        self.size = max(1, size)
+        self.lock = Lock()
+        self.created = 0
+        # most recently used first, its connection is the likeliest alive
+        self.idle = LifoQueue()
+
+    def add(self, api):
+        with self.lock:
+            self.created += 1
+        self.idle.put(api)
+
+    @contextmanager
+    def acquire(self):
+        api = self.take()
+        try:
+            yield api
+        finally:
+            self.idle.put(api)
+
+    def take(self):
+        with self.lock:
+            if self.idle.empty() and self.created < self.size:
+                self.created += 1
+                create = True
+            else:
+                create = False
+        if not create:
+            return self.idle.get()
+        try:
+            return self.create()
+        except Exception:
+            with self.lock:
+                self.created -= 1
+            raise
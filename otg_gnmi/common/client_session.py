@@ -1,31 +1,201 @@
-
 # client_session.py
+import asyncio
+from collections import OrderedDict, deque
+from threading import Lock
+
+POLICY_COALESCE = 'coalesce'
+POLICY_DROP_OLDEST = 'drop-oldest'
+POLICY_DISCONNECT = 'disconnect'
+SLOW_CONSUMER_POLICIES = [
+    POLICY_COALESCE,
+    POLICY_DROP_OLDEST,
+    POLICY_DISCONNECT
+]
+
+
+class SessionQueue(object):
+    """Bounded queue of (path, sample) pending for one session, filled by
+    the collector threads and drained by the session's Subscribe stream.
+
+    What happens when the consumer falls behind depends on the policy:
+    - coalesce: a path has at most one pending entry, holding its latest
+      sample, the queue is bounded by the paths of the session
+    - drop-oldest: every sample is queued, past maxsize samples pending for
+      a path its oldest one is dropped
+    - disconnect: every sample is queued, past maxsize samples pending for
+      a path the session is flagged as overflowed so that its stream gets
+      closed, later samples are dropped
+
+    An ON_CHANGE session missing samples of a path is sent the whole next
+    one, as the deltas that follow do not carry the changes it missed.
+    """
+
+    def __init__(self, maxsize, policy=POLICY_COALESCE):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.lock = Lock()
+        # path -> latest sample (coalesce) or deque of samples, in the order
+        # the paths were first queued
+        self.items = OrderedDict()
+        self.size = 0
+        self.enqueued = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.overflowed = False
+
+    def put(self, path, sample):
+        with self.lock:
+            self.enqueued += 1
+            if self.policy == POLICY_COALESCE:
+                if path in self.items:
+                    self.coalesced += 1
+                else:
+                    self.size += 1
+                self.items[path] = sample
+                return
+            if self.overflowed:
+                # the stream is being closed, stop growing the queue
+                self.dropped += 1
+                return
+            pending = self.items.get(path)
+            if pending is None:
+                pending = deque()
+                self.items[path] = pending
+            pending.append(sample)
+            self.size += 1
+            if len(pending) > self.maxsize:
+                if self.policy == POLICY_DISCONNECT:
+                    self.overflowed = True
+                else:
+                    pending.popleft()
+                    self.size -= 1
+                    self.dropped += 1
+
+    def drain(self):
+        with self.lock:
+            if self.policy == POLICY_COALESCE:
+                items = list(self.items.items())
+            else:
+                items = [
+                    (path, sample)
+                    for path, pending in self.items.items()
+                    for sample in pending
+                ]
+            self.items = OrderedDict()
+            self.size = 0
+            return items
+
+    def __len__(self):
+        return self.size
+
+
 class ClientSession(object):
-    def __init__(self, context, requests):
+    def __init__(self, context, requests, queue_size=1000,
+                 queue_policy=POLICY_COALESCE):
         self.context = context
         self.subscribed_paths = {}
+        self.subscriptions = {}
+        # per key subscriptions of the wildcard paths, by concrete path
+        self.children = {}
         self.sent_sync = False
+        self.sync_requested = False
+        self.pending_polls = 0
+        # background task reading the requests sent after the first one
+        self.reader = None
+        self.requests_done = False
         self.mode = 0  # STREAM=0, ONCE=1, POLL=2
         self.requests = requests
+        self.queue = SessionQueue(queue_size, queue_policy)
+        self.loop = asyncio.get_event_loop()
+        self.stats_event = asyncio.Event()
 
     def send_sync(self):
         if self.sent_sync is False:
-            for val in self.subscribed_paths.values():
-                if val == 0:
-                    return False
+            if not self.sync_requested:
+                for val in self.subscribed_paths.values():
+                    if val == 0:
+                        return False
             self.sent_sync = True
+            self.sync_requested = False
             return True
         else:
             return False
 
-    def register_path(self, path):
+    def request_sync(self):
+        # every answer to a Poll ends with a sync_response, even when some
+        # paths had nothing to report
+        self.sent_sync = False
+        self.sync_requested = True
+
+    def register_path(self, path, subscription):
         if path not in self.subscribed_paths:
             self.subscribed_paths[path] = 0
+        self.subscriptions[path] = subscription
 
     def deregister_path(self, path):
         if path in self.subscribed_paths:
             self.subscribed_paths.pop(path)
+        if path in self.subscriptions:
+            self.subscriptions.pop(path)
+        for child_path in [
+                child_path
+                for child_path, subscription in self.children.items()
+                if subscription.path == path]:
+            self.children.pop(child_path)
+
+    def prune_children(self, path, children):
+        # drops the keys of the wildcard `path` no longer in `children`,
+        # e.g. flows gone from the backend
+        for child_path in [
+                child_path
+                for child_path, subscription in self.children.items()
+                if subscription.path == path and child_path not in children]:
+            self.children.pop(child_path)
+
+    def get_subscription(self, path):
+        subscription = self.subscriptions.get(path)
+        if subscription is None:
+            subscription = self.children.get(path)
+        return subscription
 
     def update_stats(self, path):
         if path in self.subscribed_paths:
             self.subscribed_paths[path] += 1
+
+    def is_published(self, path, generation):
+        subscription = self.get_subscription(path)
+        if subscription is None:
+            return True
+        return subscription.published_generation >= generation
+
+    def mark_published(self, path, generation):
+        subscription = self.get_subscription(path)
+        if subscription is not None:
+            subscription.published_generation = generation
+
+    def enqueue(self, path, sample):
+        self.queue.put(path, sample)
+
+    def is_overflowed(self):
+        return self.queue.overflowed
+
+    def stop_reading(self):
+        if self.reader is not None and not self.reader.done():
+            self.reader.cancel()
+
+    def notify(self):
+        # Called from the collector threads, hence hop onto the event loop
+        # owning this session before touching the asyncio event.
+        if self.loop.is_closed():
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.stats_event.set)
+        except RuntimeError:
+            pass
+
+    async def wait_for_stats(self, timeout):
+        try:
+            await asyncio.wait_for(self.stats_event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.stats_event.clear()
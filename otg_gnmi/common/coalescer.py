@@ -0,0 +1,58 @@
+# coalescer.py
+import asyncio
+
+
+class FetchBatch(object):
+    def __init__(self, loop):
+        self.subscriptions = {}
+        self.future = loop.create_future()
+
+
+class FetchCoalescer(object):
+    """Merges concurrent on-demand fetches into shared backend calls.
+
+    Callers ask for a set of subscriptions under a key (one key per backend
+    call, e.g. the metric callback). While a fetch for a key is in flight,
+    further requests for that key are merged into a single pending batch
+    which is fetched as soon as the previous one completes. Whatever the
+    number of concurrent callers, at most one fetch per key is in flight
+    and at most one more is queued behind it.
+
+    `fetch` is a blocking function taking a list of subscriptions, it is
+    run in `executor` (the loop default one if None). Must be used from the
+    event loop thread.
+    """
+
+    def __init__(self, fetch, executor=None):
+        self.fetch = fetch
+        self.executor = executor
+        self.pending = {}  # key -> FetchBatch not started yet
+        self.running = {}  # key -> task fetching the batches of that key
+
+    async def request(self, key, subscriptions):
+        loop = asyncio.get_event_loop()
+        batch = self.pending.get(key)
+        if batch is None or batch.future.get_loop() is not loop:
+            batch = FetchBatch(loop)
+            self.pending[key] = batch
+        for sub in subscriptions:
+            batch.subscriptions[sub.stringpath] = sub
+        task = self.running.get(key)
+        if task is None or task.done() or task.get_loop() is not loop:
+            self.running[key] = asyncio.ensure_future(self.run(key))
+        # a cancelled caller must not cancel the fetch shared with others
+        await asyncio.shield(batch.future)
+
+    async def run(self, key):
+        loop = asyncio.get_event_loop()
+        while key in self.pending:
+            batch = self.pending.pop(key)
+            try:
+                await loop.run_in_executor(
+                    self.executor,
+                    self.fetch,
+                    list(batch.subscriptions.values())
+                )
+                batch.future.set_result(None)
+            except Exception as ex:
+                batch.future.set_exception(ex)
@@ -0,0 +1,100 @@
+# converter.py
+from google.protobuf.descriptor import FieldDescriptor
+
+FIELD_SCALAR = 0
+FIELD_ENUM = 1
+FIELD_MESSAGE = 2
+FIELD_REPEATED_MESSAGE = 3
+FIELD_REPEATED_SCALAR = 4
+
+g_Converters = {}
+
+
+def get_converter(message_class):
+    """Returns the MessageConverter of an otg_pb2 message class, compiled
+    once per class.
+    """
+    converter = g_Converters.get(message_class)
+    if converter is None:
+        converter = MessageConverter(message_class)
+        # registered ahead of compiling, messages may nest themselves
+        g_Converters[message_class] = converter
+        converter.compile()
+    return converter
+
+
+class MessageConverter(object):
+    """Converts snappi objects straight into the matching otg_pb2 message.
+
+    The field map is compiled from the message descriptor once: converting
+    a metric walks its properties and sets the fields directly, without the
+    JSON serialization and parsing round trip. Enums are mapped by value
+    name, properties unknown to the message are ignored.
+    """
+
+    def __init__(self, message_class):
+        self.message_class = message_class
+        self.fields = {}  # name -> (kind, enum values or nested converter)
+
+    def compile(self):
+        message_class = self.message_class
+        for field in message_class.DESCRIPTOR.fields:
+            repeated = field.label == FieldDescriptor.LABEL_REPEATED
+            if field.type == FieldDescriptor.TYPE_MESSAGE:
+                converter = get_converter(
+                    message_class_of(message_class, field))
+                kind = FIELD_REPEATED_MESSAGE if repeated else FIELD_MESSAGE
+                self.fields[field.name] = (kind, converter)
+            elif field.type == FieldDescriptor.TYPE_ENUM:
+                self.fields[field.name] = (
+                    FIELD_ENUM,
+                    {
+                        name: value.number
+                        for name, value in
+                        field.enum_type.values_by_name.items()
+                    }
+                )
+            elif repeated:
+                self.fields[field.name] = (FIELD_REPEATED_SCALAR, None)
+            else:
+                self.fields[field.name] = (FIELD_SCALAR, None)
+
+    def convert(self, obj):
+        """`obj` is a snappi object or a dict of its properties, e.g. the
+        delta of two samples.
+        """
+        message = self.message_class()
+        self.fill(message, obj)
+        return message
+
+    def fill(self, message, obj):
+        if isinstance(obj, dict):
+            properties = obj
+        else:
+            properties = obj._properties
+        for name, value in properties.items():
+            if value is None:
+                continue
+            field = self.fields.get(name)
+            if field is None:
+                continue
+            kind, extra = field
+            if kind == FIELD_SCALAR:
+                setattr(message, name, value)
+            elif kind == FIELD_ENUM:
+                setattr(message, name, extra.get(value, 0))
+            elif kind == FIELD_MESSAGE:
+                extra.fill(getattr(message, name), value)
+            elif kind == FIELD_REPEATED_MESSAGE:
+                items = getattr(message, name)
+                for item in value:
+                    extra.fill(items.add(), item)
+            else:
+                getattr(message, name).extend(value)
+
+
+def message_class_of(message_class, field):
+    value = getattr(message_class(), field.name)
+    if field.label == FieldDescriptor.LABEL_REPEATED:
+        value = value.add()
+    return type(value)
@@ -0,0 +1,129 @@
+# deadband.py
+
+# field name of the dead-band applied to every field without its own
+DEFAULT_FIELD = '*'
+# percent by which the rate of a counter without its own dead-band has to
+# change to be reported. Rates are computed from the fetch times, whose
+# jitter alone moves them by a few percent.
+COUNTER_RATE_TOLERANCE = 5
+
+
+class DeadBand(object):
+    """Smallest change of a numeric field worth reporting, either absolute
+    or in percent of the value last reported.
+    """
+
+    def __init__(self, threshold, percent=False):
+        self.threshold = threshold
+        self.percent = percent
+
+    def exceeded(self, reported, value):
+        change = abs(value - reported)
+        if self.percent:
+            return change * 100 > self.threshold * abs(reported)
+        return change > self.threshold
+
+
+def parse_deadbands(specs):
+    """Parses `field=threshold` specs, e.g. `loss=0.5` or
+    `frames_rx_rate=5%`, into a dict of field -> DeadBand. The `*` field
+    applies to every numeric field without its own dead-band.
+    """
+    deadbands = {}
+    for spec in specs or []:
+        field, sep, threshold = spec.partition('=')
+        field = field.strip()
+        threshold = threshold.strip()
+        percent = threshold.endswith('%')
+        if percent:
+            threshold = threshold[:-1]
+        try:
+            threshold = float(threshold)
+        except ValueError:
+            threshold = None
+        if not sep or not field or threshold is None or threshold < 0:
+            raise Exception(
+                'Invalid dead-band {}, expected field=value or '
+                'field=value%'.format(spec))
+        deadbands[field] = DeadBand(threshold, percent)
+    return deadbands
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class ChangeDetector(object):
+    """Picks the fields of successive samples of a metric reported to
+    ON_CHANGE subscribers.
+
+    A field is compared with the value last reported rather than with the
+    previous sample, so slow drifts are reported once they add up to more
+    than the dead-band. With `counter_rate`, int64 counters that keep
+    increasing are reported only when their rate changes beyond their own
+    dead-band, or else by more than `rate_tolerance` percent: a counter
+    growing at a steady rate (or not at all) is considered unchanged.
+    """
+
+    def __init__(self, deadbands=None, counter_rate=False,
+                 rate_tolerance=COUNTER_RATE_TOLERANCE):
+        self.deadbands = deadbands or {}
+        self.default = self.deadbands.get(DEFAULT_FIELD)
+        self.counter_rate = counter_rate
+        self.rate_deadband = DeadBand(rate_tolerance, percent=True)
+        self.reported = {}  # field -> value last reported
+        self.rates = {}  # counter -> rate when last reported
+        self.prev = None  # counter -> value of the previous sample
+        self.prev_polled = None
+
+    def compute_delta(self, properties, types, polled):
+        """Fields of `properties` changed since last reported. `types` is
+        the _TYPES of the snappi object, `polled` the sample time.
+        """
+        delta = {}
+        elapsed = None
+        if self.prev_polled is not None and polled is not None:
+            elapsed = polled - self.prev_polled
+        counters = {}
+        for key, value in properties.items():
+            if self.is_counter(key, value, types):
+                counters[key] = value
+                if self.counter_changed(key, value, elapsed):
+                    delta[key] = value
+            elif self.changed(key, value):
+                delta[key] = value
+        for key, value in delta.items():
+            self.reported[key] = value
+        self.prev = counters
+        self.prev_polled = polled
+        return delta
+
+    def is_counter(self, key, value, types):
+        return self.counter_rate and is_number(value) and \
+            types.get(key, {}).get('format') == 'int64'
+
+    def changed(self, key, value):
+        return key not in self.reported or \
+            self.exceeds(key, self.reported[key], value)
+
+    def counter_changed(self, key, value, elapsed):
+        prev = None if self.prev is None else self.prev.get(key)
+        if prev is None or value < prev or not elapsed or elapsed <= 0:
+            # first sample, counter cleared or no time base: report the
+            # value and start over
+            self.rates[key] = None
+            return self.changed(key, value)
+        rate = (value - prev) / elapsed
+        last_rate = self.rates.get(key)
+        deadband = self.deadbands.get(key, self.rate_deadband)
+        if last_rate is not None and not deadband.exceeded(last_rate, rate):
+            return False
+        self.rates[key] = rate
+        return True
+
+    def exceeds(self, key, reported, value):
+        deadband = self.deadbands.get(key, self.default)
+        if deadband is None or not is_number(value) or \
+                not is_number(reported):
+            return value != reported
+        return deadband.exceeded(reported, value)
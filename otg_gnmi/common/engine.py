@@ -0,0 +1,151 @@
+# engine.py
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+
+from .scheduler import AdaptiveInterval, TimerWheel
+
+
+class MetricKind(object):
+    """A family of metrics fetched together, e.g. port or flow metrics.
+    """
+    def __init__(self, key, name, subscriptions, resolution, interval):
+        self.key = key
+        self.name = name
+        # path -> SubscriptionReq, owned by the TestManager registry
+        self.subscriptions = subscriptions
+        self.wheel = TimerWheel(resolution)
+        # default collection interval of the kind, adapted to the latency
+        self.interval = interval
+        # fetches of this kind in flight, groups falling due meanwhile are
+        # served by the next round
+        self.inflight = 0
+
+
+class CollectionEngine(object):
+    """Collects every registered metric kind from a single scheduler thread.
+
+    Due subscriptions of a kind are split by `group_key` into one fetch per
+    backend request, the fetches run concurrently on a bounded pool of
+    workers. A kind starts a new round only once its previous one completed.
+    A kind without subscriptions costs nothing: the scheduler sleeps until
+    the next group falls due, or until woken up by a new schedule.
+
+    Each fetch is timed to adapt the default interval of its kind, when the
+    interval moves `on_interval_change` is called with the kind key (and the
+    lock held) so that the caller reschedules its subscriptions.
+
+    `lock` is the registry lock of the caller, schedule() and unschedule()
+    must be called with it held.
+    """
+
+    def __init__(self, collect, lock, workers, resolution, logger,
+                 group_key=None, on_interval_change=None):
+        self.collect = collect
+        self.group_key = group_key
+        self.on_interval_change = on_interval_change
+        self.lock = lock
+        self.resolution = resolution
+        self.logger = logger
+        self.kinds = {}
+        self.pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='collector')
+        self.wakeup = Event()
+        self.stopped = False
+        self.thread = None
+
+    def register_kind(self, key, name, subscriptions, initial_interval,
+                      min_interval, max_interval):
+        self.kinds[key] = MetricKind(
+            key,
+            name,
+            subscriptions,
+            self.resolution,
+            AdaptiveInterval(initial_interval, min_interval, max_interval)
+        )
+
+    def get_interval(self, key):
+        return self.kinds[key].interval.interval
+
+    def start(self):
+        self.thread = Thread(target=self.run, name='collection-scheduler')
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.pool.shutdown(wait=True)
+
+    def schedule(self, key, member, interval):
+        self.kinds[key].wheel.add(member, interval, time.monotonic())
+        self.wakeup.set()
+
+    def unschedule(self, key, member):
+        self.kinds[key].wheel.remove(member)
+
+    def run(self):
+        while self.stopped is False:
+            self.wakeup.clear()
+            jobs = []
+            delays = []
+            self.lock.acquire()
+            now = time.monotonic()
+            for kind in self.kinds.values():
+                if kind.inflight > 0:
+                    continue
+                due = kind.wheel.pop_due(now)
+                groups = {}
+                for path in due:
+                    if path not in kind.subscriptions:
+                        continue
+                    sub = kind.subscriptions[path]
+                    group = None
+                    if self.group_key is not None:
+                        group = self.group_key(sub)
+                    groups.setdefault(group, {})[path] = sub
+                if len(groups) > 0:
+                    kind.inflight = len(groups)
+                    for subscriptions in groups.values():
+                        jobs.append((kind, subscriptions))
+                    continue
+                delay = kind.wheel.next_due(now)
+                if delay is not None:
+                    delays.append(delay)
+            self.lock.release()
+
+            for kind, subscriptions in jobs:
+                try:
+                    self.pool.submit(self.run_job, kind, subscriptions)
+                except RuntimeError:
+                    # pool shut down while stopping
+                    return
+
+            # no timeout when nothing is scheduled, a new schedule or a
+            # completed fetch wakes the scheduler up
+            self.wakeup.wait(min(delays) if len(delays) > 0 else None)
+
+    def run_job(self, kind, subscriptions):
+        start = time.monotonic()
+        try:
+            self.collect(subscriptions, kind.name)
+        except Exception:
+            self.logger.error(
+                'Fatal error in collecting %s stats', kind.name, exc_info=True)
+        finally:
+            self.lock.acquire()
+            try:
+                kind.inflight -= 1
+                if kind.interval.record(time.monotonic() - start):
+                    self.logger.info(
+                        '%s interval set to %.3fs, latency %.3fs',
+                        kind.name,
+                        kind.interval.interval,
+                        kind.interval.latency
+                    )
+                    if self.on_interval_change is not None:
+                        self.on_interval_change(kind.key)
+            finally:
+                self.lock.release()
+            self.wakeup.set()
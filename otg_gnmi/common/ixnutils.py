@@ -1,26 +1,43 @@
 # ixnutils.py
 import asyncio
 import datetime
-import json
 import time
 import types
-from threading import Lock, Thread
-import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 
+import grpc
 import snappi
 from google.protobuf.any_pb2 import Any
 
 from ..autogen import gnmi_pb2
 
 from snappi import otg_pb2
+from .api_pool import ApiPool, set_api_timeout
 from .client_session import ClientSession
-from .utils import (RequestPathBase, RequestType, get_subscription_type,
-                    get_time_elapsed, gnmi_path_to_string, init_logging)
+from .converter import get_converter
+from .coalescer import FetchCoalescer
+from .deadband import ChangeDetector, parse_deadbands
+from .engine import CollectionEngine
+from .serializer import get_serializer
+from .utils import (RequestPathBase, RequestType, get_selectable_columns,
+                    get_subscribed_columns, get_subscription_type,
+                    get_time_elapsed, get_typed_value, get_varint_size,
+                    gnmi_path_to_string, init_logging)
 
 ATHENA_POLL_INTERVAL = 0.05
 IXN_POLL_INTERVAL = 4
 POLL_INTERVAL = IXN_POLL_INTERVAL
-
+# Upper bound on how long a Subscribe stream sleeps waiting for new samples
+# before re-checking whether the server is still running.
+NOTIFY_TIMEOUT = 1
+# Granularity of the collection timer wheels and lower bound for any
+# subscription sample_interval.
+SCHEDULER_RESOLUTION = 0.01
+MIN_SAMPLE_INTERVAL = SCHEDULER_RESOLUTION
+# Fraction of its own sample_interval a session waits between two updates of
+# a path that is collected faster for another session.
+SAMPLE_INTERVAL_SLACK = 0.9
 g_RequestId = -1
 
 
@@ -29,37 +46,176 @@ def get_request_id():
     g_RequestId += 1
 
 
-class SubscriptionReq:
-    def __init__(self, subscriptionList, session, subscription):
-        # Assign subscriptionList properties
-        self.client = session
-        self.parent_encoding = subscriptionList.encoding
-        self.parent_mode = subscriptionList.mode
+class StatsSample:
+    """Snapshot of one collection cycle for a SubscriptionReq.
+
+    The collectors build a new sample and swap it in with a single attribute
+    assignment, so the event loop reads samples without taking any lock.
+    Apart from the lazily filled encode cache a sample is never modified.
+    """
+    def __init__(self, generation, polled, stats=None, delta=None,
+                 error=None):
+        self.generation = generation
+        self.polled = polled
+        self.stats = stats
+        self.delta = delta
+        self.error = error
+        # encoded responses keyed by (encoding, on_change) so that every
+        # distinct wire form is built only once whatever the number of
+        # subscribers
+        self.encoded = {}
+        # payloads keyed by (encoding family, on_change), shared by the
+        # encodings differing only by the TypedValue field, e.g. JSON and
+        # JSON_IETF
+        self.payloads = {}
+        # the same responses serialized to bytes, handed as is to every
+        # stream using the pass-through serializer. Dropped together with
+        # the sample once the next one is published.
+        self.serialized = {}
 
+
+class SubscriptionReq:
+    """A metric path collected once on behalf of every session subscribed to
+    it. Sessions attach through SessionSubscription and are refcounted, the
+    path is collected until the last one detaches.
+    """
+    def __init__(self, subscription):
         # Assign subscription item peroperties
         self.uniqueId = get_request_id()
-        self.mode = subscription.mode
         self.gnmipath = subscription.path
         self.stringpath, self.name, self.key = gnmi_path_to_string(
             subscription
         )
         self.type = get_subscription_type(self.stringpath)
-        self.callback, self.deserializer = TestManager.Instance().get_callback(
+        self.callback, self.converter = TestManager.Instance().get_callback(
             self.stringpath
         )
-        self.sample_interval = subscription.sample_interval
+        self.subscribers = {}
+        # a '*' key stands for every name of the metric kind, fetched with
+        # a single request and published per key through children
+        self.wildcard = self.name == '*'
+        self.children = {}  # concrete path -> SubscriptionReq
         self.last_polled = None
-        self.last_yield = None
         self.active = False
+        # working state, only touched by the collector of this path
         self.curr_stats = None
-        self.prev_stats = None
         self.delta_stats = None
-        self.encoded_stats = None
+        # fields worth an ON_CHANGE update, within the dead-bands
+        self.change_detector = ChangeDetector(
+            TestManager.Instance().deadbands,
+            TestManager.Instance().counter_rate_change,
+            TestManager.Instance().counter_rate_tolerance
+        )
         self.availabel_cols = []
-        self.subscribed_cols = []
+        # one typed update per leaf instead of a single encoded blob
+        self.leaf_updates = TestManager.Instance().leaf_updates
+        # column -> full gNMI path of the leaf, built once
+        self.leaf_paths = {}
+        self.serializer = TestManager.Instance().serializer
+        # columns fetched for this path, empty for every column
+        self.subscribed_cols = get_subscribed_columns(subscription.path)
+        self.error = None
+        # Incremented every time the collectors produce a new sample (or a
+        # new error) so sessions can tell fresh data from already sent data.
+        self.generation = 0
+        # last published StatsSample, read by the event loop
+        self.sample = None
+
+    @property
+    def refcount(self):
+        return len(self.subscribers)
+
+    def add_subscriber(self, session_sub):
+        self.subscribers[session_sub.session] = session_sub
+
+    def remove_subscriber(self, session):
+        if session in self.subscribers:
+            self.subscribers.pop(session)
+
+    def get_child(self, name):
+        """Subscription of one key of a wildcard path, created the first
+        time the key is collected. Children share the subscribers of the
+        wildcard and are never registered on their own.
+        """
+        stringpath = self.stringpath.replace(
+            '[{}:*]'.format(self.key), '[{}:{}]'.format(self.key, name), 1)
+        child = self.children.get(stringpath)
+        if child is None:
+            path = gnmi_pb2.Path()
+            path.CopyFrom(self.gnmipath)
+            for ele in path.elem:
+                if ele.key.get(self.key) == '*':
+                    ele.key[self.key] = name
+                    break
+            child = SubscriptionReq(gnmi_pb2.Subscription(path=path))
+            child.subscribers = self.subscribers
+            self.children[stringpath] = child
+        return child
+
+    def get_samples(self):
+        # (path, sample) to publish for this subscription, a wildcard path
+        # publishes its keys then its own sample marking the completed fetch
+        samples = [
+            (child.stringpath, child.sample)
+            for child in list(self.children.values())
+        ]
+        samples.append((self.stringpath, self.sample))
+        return samples
+
+    def get_collection_interval(self, default=None):
+        """Shortest interval wanted by the subscribers, None when every
+        subscriber is poll driven and nothing needs to be collected.
+        Subscribers leaving the cadence to the target get `default`.
+        """
+        intervals = [
+            session_sub.get_collection_interval(default)
+            for session_sub in list(self.subscribers.values())
+        ]
+        intervals = [
+            interval for interval in intervals if interval is not None
+        ]
+        if len(intervals) == 0:
+            return None
+        return min(intervals)
+
+    def update_stats(self, metric):
+        self.curr_stats = metric
+        self.error = None
+        self.compute_delta()
+        self.generation += 1
+        sample = StatsSample(
+            self.generation,
+            self.last_polled,
+            stats=self.curr_stats,
+            delta=self.delta_stats
+        )
+        # encode ahead for the current subscribers while still on the
+        # collector thread
+        for session_sub in list(self.subscribers.values()):
+            self.encode_stats(
+                session_sub.encoding,
+                session_sub.mode == gnmi_pb2.SubscriptionMode.ON_CHANGE,
+                sample
+            )
+        self.sample = sample
+
+    def update_collected(self):
+        # sample of a wildcard path, its stats are held by the children
         self.error = None
+        self.generation += 1
+        self.sample = StatsSample(self.generation, self.last_polled)
+
+    def update_error(self, error):
+        self.error = error
+        self.generation += 1
+        self.sample = StatsSample(
+            self.generation,
+            self.last_polled,
+            stats=self.curr_stats,
+            error=error
+        )
 
-    def encode_stats(self, stats_name):
+    def encode_stats(self, encoding, on_change=False, sample=None):
 
         def add_header(stats_name, val):
             path = gnmi_pb2.Path(elem=[
@@ -72,57 +228,222 @@ class SubscriptionReq:
             sub_res = gnmi_pb2.SubscribeResponse(update=notification)
             return sub_res
 
-        stats = None
-        if self.mode == gnmi_pb2.SubscriptionMode.ON_CHANGE:
-
-            if self.delta_stats is None or len(self.delta_stats) == 0:
-                self.encoded_stats = None
-                return
-            stats = json.dumps(self.delta_stats)
-        else:
-            stats = self.curr_stats.serialize()
+        if sample is None:
+            sample = self.sample
+        if sample is None or sample.stats is None:
+            return None
+        cache_key = self.get_cache_key(encoding, on_change)
+        if cache_key in sample.encoded:
+            return sample.encoded[cache_key]
+
+        stats = sample.stats
+        if on_change:
+            if sample.delta is None or len(sample.delta) == 0:
+                sample.encoded[cache_key] = None
+                return None
+            stats = sample.delta
+
+        if self.leaf_updates:
+            # typed values whatever the encoding, the leaves are scalars
+            encoded = None
+            updates = self.encode_leaves(stats)
+            if len(updates) > 0:
+                notification = gnmi_pb2.Notification(
+                    timestamp=int(round(time.time() * 1000)),
+                    update=updates)
+                encoded = gnmi_pb2.SubscribeResponse(update=notification)
+            sample.encoded[cache_key] = encoded
+            return encoded
 
         val = None
-        if (self.parent_encoding == gnmi_pb2.Encoding.JSON):
-            val = gnmi_pb2.TypedValue(json_val=stats.encode("utf-8"))
-            self.encoded_stats = add_header(stats_name, val)
-            return
-        if (self.parent_encoding == gnmi_pb2.Encoding.JSON_IETF):
-            val = gnmi_pb2.TypedValue(json_ietf_val=stats.encode("utf-8"))
-            self.encoded_stats = add_header(stats_name, val)
-            return
-        if (self.parent_encoding == gnmi_pb2.Encoding.PROTO):
-            stats = self.encode_metrics(stats)
-            val = stats
-            val = gnmi_pb2.TypedValue(any_val=stats)
-            self.encoded_stats = add_header(stats_name, val)
-            return
+        if (encoding == gnmi_pb2.Encoding.JSON):
+            val = gnmi_pb2.TypedValue(
+                json_val=self.get_payload(sample, 'json', on_change, stats))
+        elif (encoding == gnmi_pb2.Encoding.JSON_IETF):
+            val = gnmi_pb2.TypedValue(
+                json_ietf_val=self.get_payload(
+                    sample, 'json', on_change, stats))
+        elif (encoding == gnmi_pb2.Encoding.PROTO):
+            val = gnmi_pb2.TypedValue(
+                any_val=self.get_payload(sample, 'proto', on_change, stats))
+        encoded = None
+        if val is not None:
+            encoded = add_header(self.name, val)
+        sample.encoded[cache_key] = encoded
+        return encoded
+
+    def serialize_stats(self, encoding, on_change=False, sample=None):
+        if sample is None:
+            sample = self.sample
+        if sample is None:
+            return None
+        cache_key = self.get_cache_key(encoding, on_change)
+        if cache_key in sample.serialized:
+            return sample.serialized[cache_key]
+        encoded = self.encode_stats(encoding, on_change, sample)
+        serialized = None
+        if encoded is not None:
+            serialized = encoded.SerializeToString()
+        sample.serialized[cache_key] = serialized
+        return serialized
+
+    def get_cache_key(self, encoding, on_change):
+        if self.leaf_updates:
+            # typed leaves are the same whatever the encoding
+            return (None, on_change)
+        return (encoding, on_change)
+
+    def get_payload(self, sample, family, on_change, stats):
+        payload_key = (family, on_change)
+        payload = sample.payloads.get(payload_key)
+        if payload is None:
+            if family == 'json':
+                payload = self.encode_json(stats)
+            else:
+                payload = self.encode_metrics(stats)
+            sample.payloads[payload_key] = payload
+        return payload
 
-    def encode_metrics(self, stats_json):
-        stats = json.loads(stats_json)
-        metric = self.deserializer.deserialize(stats)
+    def encode_leaves(self, stats):
+        if isinstance(stats, dict):
+            properties = stats
+        else:
+            properties = stats._properties
+        updates = []
+        for column, value in properties.items():
+            if value is None or column == self.key:
+                continue
+            if len(self.subscribed_cols) > 0 and \
+                    column not in self.subscribed_cols:
+                continue
+            val = get_typed_value(value)
+            if val is None:
+                # nested objects, e.g. timestamps
+                val = gnmi_pb2.TypedValue(json_val=self.encode_json(value))
+            updates.append(
+                gnmi_pb2.Update(path=self.get_leaf_path(column), val=val))
+        return updates
+
+    def get_leaf_path(self, column):
+        path = self.leaf_paths.get(column)
+        if path is None:
+            # the keyed part of the subscribed path, e.g.
+            # /flow_metrics[name=F1], followed by the leaf
+            elems = []
+            for ele in self.gnmipath.elem:
+                elems.append(ele)
+                if len(ele.key) > 0:
+                    break
+            elems.append(gnmi_pb2.PathElem(name=column))
+            path = gnmi_pb2.Path(elem=elems)
+            self.leaf_paths[column] = path
+        return path
+
+    def encode_json(self, stats):
+        return self.serializer.encode(stats)
+
+    def encode_metrics(self, stats):
+        # straight from the snappi object (or delta) to the otg_pb2 message
+        metric = self.converter.convert(stats)
         target = Any()
         target.Pack(metric)
         return target
 
     def compute_delta(self):
-        delta = {}
         if self.curr_stats is None:
             self.delta_stats = None
             return
+        self.delta_stats = self.change_detector.compute_delta(
+            self.curr_stats._properties,
+            self.curr_stats._TYPES,
+            self.last_polled
+        )
 
-        if self.prev_stats is None:
-            for key, curr_value in self.curr_stats._properties.items():
-                delta[key] = curr_value
-            self.delta_stats = delta
-            return
 
-        for key, curr_value in self.curr_stats._properties.items():
-            prev_val = self.prev_stats._get_property(key)
-            if curr_value != prev_val:
-                delta[key] = curr_value
-        self.delta_stats = delta
-        return
+class SessionSubscription:
+    """Options and publishing state of one session for a shared
+    SubscriptionReq.
+    """
+    def __init__(self, sub, session, subscriptionList, subscription,
+                 parent=None):
+        self.sub = sub
+        self.session = session
+        self.subscriptionList = subscriptionList
+        self.subscription = subscription
+        # path the session subscribed to, the wildcard one for its keys
+        self.path = sub.stringpath if parent is None else parent.path
+        self.encoding = subscriptionList.encoding
+        self.parent_mode = subscriptionList.mode
+        self.mode = subscription.mode
+        self.sample_interval = subscription.sample_interval
+        self.heartbeat_interval = subscription.heartbeat_interval
+        self.published_generation = 0
+        self.last_sample = None
+        self.last_yield = None
+
+    def has_options(self, subscriptionList, subscription):
+        return self.encoding == subscriptionList.encoding and \
+            self.mode == subscription.mode and \
+            self.sample_interval == subscription.sample_interval and \
+            self.heartbeat_interval == subscription.heartbeat_interval
+
+    def get_child(self, child):
+        return SessionSubscription(
+            child,
+            self.session,
+            self.subscriptionList,
+            self.subscription,
+            parent=self
+        )
+
+    def get_collection_interval(self, default=None):
+        if self.parent_mode != gnmi_pb2.SubscriptionList.Mode.STREAM:
+            # ONCE and POLL are fetched on demand
+            return None
+        # sample_interval and heartbeat_interval are in nanoseconds
+        if self.mode == gnmi_pb2.SubscriptionMode.SAMPLE and \
+                self.sample_interval > 0:
+            return max(self.sample_interval / 10 ** 9, MIN_SAMPLE_INTERVAL)
+        if default is None:
+            return POLL_INTERVAL
+        return default
+
+    def sample_due(self, sample):
+        # the shared path may be collected faster on behalf of another
+        # session, keep to our own sample_interval (with some slack for
+        # collection jitter)
+        interval = self.get_collection_interval()
+        if self.mode != gnmi_pb2.SubscriptionMode.SAMPLE or \
+                self.sample_interval == 0 or interval is None or \
+                self.last_sample is None or sample.polled is None:
+            return True
+        elapsed = sample.polled - self.last_sample
+        return elapsed >= SAMPLE_INTERVAL_SLACK * interval
+
+    def heartbeat_due(self):
+        if self.heartbeat_interval == 0 or self.last_yield is None:
+            return False
+        elapsed = time.time() - self.last_yield
+        return elapsed >= self.heartbeat_interval / 10 ** 9
+
+    def missed_samples(self, sample):
+        # samples collected since the last one published were coalesced or
+        # dropped from the session queue, their changes never reached it
+        return sample.generation > self.published_generation + 1
+
+    def get_encoded_stats(self, sample, serialized=False, missed=False):
+        encode = self.sub.encode_stats
+        if serialized:
+            encode = self.sub.serialize_stats
+        if self.mode == gnmi_pb2.SubscriptionMode.ON_CHANGE and \
+                self.last_yield is not None and not missed:
+            encoded = encode(self.encoding, True, sample)
+            if encoded is None and self.heartbeat_due():
+                # heartbeat elapsed, resend the full metric even though
+                # nothing changed
+                encoded = encode(self.encoding, False, sample)
+            return encoded
+        return encode(self.encoding, False, sample)
 
 
 class TestManager:
@@ -153,13 +474,32 @@ class TestManager:
                     self.app_mode = options.app_mode
                     self.unittest = options.unittest
                     self.target_address = options.target_address
+                    self.batch_updates = options.batch_updates
+                    self.max_notification_size = \
+                        options.max_notification_size
+                    self.session_queue_size = options.session_queue_size
+                    self.slow_consumer_policy = options.slow_consumer_policy
+                    self.get_max_staleness = options.get_max_staleness
+                    self.collector_workers = options.collector_workers
+                    self.min_poll_interval = options.min_poll_interval
+                    self.max_poll_interval = options.max_poll_interval
+                    self.fetch_chunk_size = options.fetch_chunk_size
+                    self.backend_pool_size = options.backend_pool_size
+                    self.backend_timeout = options.backend_timeout
+                    self.leaf_updates = options.leaf_updates
+                    self.deadbands = parse_deadbands(options.deadband)
+                    self.counter_rate_change = options.counter_rate_change
+                    self.counter_rate_tolerance = \
+                        options.counter_rate_tolerance
+                    # orjson when installed, the stdlib json module else
+                    self.serializer = get_serializer()
                     log_stdout = not options.no_stdout
 
                     self.logger = init_logging(
                         'gnmi',
                         'ixutils-TestManager',
                         options.logfile,
-                        logging.DEBUG,
+                        options.log_level,
                         log_stdout
                     )
 
@@ -167,7 +507,7 @@ class TestManager:
                         'profile',
                         'ixutils-TestManager',
                         options.logfile,
-                        logging.DEBUG,
+                        options.log_level,
                         log_stdout
                     )
 
@@ -179,9 +519,64 @@ class TestManager:
                     self.flow_subscriptions = {}
                     self.neighbor_subscriptions = {}
                     self.protocol_subscriptions = {}
+                    # paths read through Get only, never scheduled. Kept
+                    # while their sample may serve another Get
+                    self.get_subscriptions_cache = {}
+                    self.get_cache_swept = time.monotonic()
 
-                    self.lock = Lock()
+                    # sets POLL_INTERVAL for the app mode
                     self.get_api()
+                    # columns each metric request can be narrowed to
+                    self.selectable_columns = {
+                        self.get_flow_metric: get_selectable_columns(
+                            snappi.FlowMetricsRequest),
+                        self.get_port_metric: get_selectable_columns(
+                            snappi.PortMetricsRequest),
+                        self.get_bgpv4_metric: get_selectable_columns(
+                            snappi.Bgpv4MetricsRequest),
+                        self.get_bgpv6_metric: get_selectable_columns(
+                            snappi.Bgpv6MetricsRequest),
+                        self.get_isis_metric: get_selectable_columns(
+                            snappi.IsisMetricsRequest)
+                    }
+
+                    # guards the registry, only ever held briefly
+                    self.lock = Lock()
+                    self.engine = CollectionEngine(
+                        self.collect_stats,
+                        self.lock,
+                        options.collector_workers,
+                        SCHEDULER_RESOLUTION,
+                        self.logger,
+                        group_key=lambda sub: sub.callback,
+                        on_interval_change=self.reschedule_subscriptions
+                    )
+                    for sub_type, meta in [
+                            (RequestType.PORT, 'Port'),
+                            (RequestType.FLOW, 'Flow'),
+                            (RequestType.NEIGHBOR, 'Neighbor'),
+                            (RequestType.PROTOCOL, 'Protocol')]:
+                        self.engine.register_kind(
+                            sub_type,
+                            meta,
+                            self.get_subscriptions(sub_type),
+                            POLL_INTERVAL,
+                            options.min_poll_interval,
+                            options.max_poll_interval
+                        )
+                    # one lock per metric callback: fetches of different
+                    # choices run concurrently, while a path fetched by its
+                    # collector and on demand at once is updated in turn
+                    self.fetch_locks = {}
+                    # runs the chunks of large batches, its size caps the
+                    # backend requests in flight for them
+                    self.chunk_pool = ThreadPoolExecutor(
+                        max_workers=options.fetch_max_inflight,
+                        thread_name_prefix='fetcher')
+                    # merges concurrent on-demand fetches (polls, ONCE,
+                    # new paths) into shared backend calls
+                    self.fetch_coalescer = FetchCoalescer(
+                        self.fetch_subscriptions, self.engine.pool)
                     self.start_worker_threads()
 
                     self.init_once = True
@@ -236,19 +631,8 @@ class TestManager:
     def start_worker_threads(self):
         api_start = datetime.datetime.now()
         try:
-            self.logger.info('Starting all collection threads')
-            self.flow_stats_thread = Thread(
-                target=self.collect_flow_stats, args=[])
-            self.flow_stats_thread.start()
-            self.neighbor_stats_thread = Thread(
-                target=self.collect_neighbor_states, args=[])
-            self.neighbor_stats_thread.start()
-            self.port_stats_thread = Thread(
-                target=self.collect_port_stats, args=[])
-            self.port_stats_thread.start()
-            self.protocol_stats_thread = Thread(
-                target=self.collect_protocol_stats, args=[])
-            self.protocol_stats_thread.start()
+            self.logger.info('Starting collection engine')
+            self.engine.start()
         finally:
             self.profile_logger.info(
                 "start_worker_threads completed!", extra={
@@ -262,14 +646,10 @@ class TestManager:
             if hasattr(self, 'logger'):
                 self.logger.info('Stopping all collection threads')
             self.stopped = True
-            if hasattr(self, 'flow_stats_thread'):
-                self.flow_stats_thread.join()
-            if hasattr(self, 'neighbor_stats_thread'):
-                self.neighbor_stats_thread.join()
-            if hasattr(self, 'port_stats_thread'):
-                self.port_stats_thread.join()
-            if hasattr(self, 'protocol_stats_thread'):
-                self.protocol_stats_thread.join()
+            if hasattr(self, 'engine'):
+                self.engine.stop()
+            if hasattr(self, 'chunk_pool'):
+                self.chunk_pool.shutdown(wait=True)
         finally:
             if hasattr(self, 'profile_logger'):
                 self.profile_logger.info(
@@ -295,21 +675,26 @@ class TestManager:
     async def create_session(self, context, request_iterator):
         api_start = datetime.datetime.now()
         try:
-            self.lock.acquire()
-            session = None
-            if context in self.client_sessions:
-                session = self.client_sessions[context]
-            else:
+            session = self.client_sessions.get(context)
+            if session is None:
+                # do not hold the lock while waiting on the client, other
+                # sessions would block on it meanwhile
                 requests = []
                 await asyncio.wait_for(
                         self.parse_requests(request_iterator, requests),
                         timeout=1.0
                     )
 
-                session = ClientSession(context, requests)
+                session = ClientSession(
+                    context,
+                    requests,
+                    self.session_queue_size,
+                    self.slow_consumer_policy
+                )
+                self.lock.acquire()
                 self.client_sessions[context] = session
+                self.lock.release()
                 self.logger.info('Created new session %s', context)
-            self.lock.release()
             return session
         finally:
             self.profile_logger.info(
@@ -321,11 +706,21 @@ class TestManager:
     async def remove_session(self, context):
         api_start = datetime.datetime.now()
         try:
+            session = None
             self.lock.acquire()
             if context in self.client_sessions:
                 session = self.client_sessions.pop(context)
                 self.logger.info('Removed new session %s', context)
             self.lock.release()
+            if session is not None:
+                self.logger.info(
+                    'Session queue stats: enqueued %s, coalesced %s, '
+                    'dropped %s, overflowed %s',
+                    session.queue.enqueued,
+                    session.queue.coalesced,
+                    session.queue.dropped,
+                    session.queue.overflowed
+                )
             return session
         finally:
             self.profile_logger.info(
@@ -356,19 +751,23 @@ class TestManager:
         api_start = datetime.datetime.now()
         try:
             if path.find(RequestPathBase.BASE_PORT_PATH) != -1:
-                return self.get_port_metric, otg_pb2.PortMetric()
+                return self.get_port_metric, get_converter(otg_pb2.PortMetric)
             if path.find(RequestPathBase.BASE_FLOW_PATH) != -1:
-                return self.get_flow_metric, otg_pb2.FlowMetric()
+                return self.get_flow_metric, get_converter(otg_pb2.FlowMetric)
             if path.find(RequestPathBase.BASE_NEIGHBORv4_PATH) != -1:
-                return self.get_ipv4_neighbor_state, otg_pb2.Neighborsv4State()
+                return self.get_ipv4_neighbor_state, \
+                    get_converter(otg_pb2.Neighborsv4State)
             if path.find(RequestPathBase.BASE_NEIGHBORv6_PATH) != -1:
-                return self.get_ipv6_neighbor_state, otg_pb2.Neighborsv6State()
+                return self.get_ipv6_neighbor_state, \
+                    get_converter(otg_pb2.Neighborsv6State)
             if path.find(RequestPathBase.BASE_BGPv4_PATH) != -1:
-                return self.get_bgpv4_metric, otg_pb2.Bgpv4Metric()
+                return self.get_bgpv4_metric, \
+                    get_converter(otg_pb2.Bgpv4Metric)
             if path.find(RequestPathBase.BASE_BGPv6_PATH) != -1:
-                return self.get_bgpv6_metric, otg_pb2.Bgpv6Metric()
+                return self.get_bgpv6_metric, \
+                    get_converter(otg_pb2.Bgpv6Metric)
             if path.find(RequestPathBase.BASE_ISIS_PATH) != -1:
-                return self.get_isis_metric, otg_pb2.IsisMetric()
+                return self.get_isis_metric, get_converter(otg_pb2.IsisMetric)
             return None
         finally:
             self.profile_logger.info(
@@ -380,9 +779,10 @@ class TestManager:
     def collect_stats(self, subscriptions, meta):
         api_start = datetime.datetime.now()
         try:
-            self.lock.acquire()
+            # The registry lock is deliberately not held here: the fetch can
+            # take seconds and the event loop must never wait on it. Results
+            # are published as immutable StatsSample snapshots instead.
             self._collect_stats(subscriptions, meta)
-            self.lock.release()
         finally:
             self.profile_logger.info(
                 "collect_stats completed!", extra={
@@ -393,32 +793,145 @@ class TestManager:
     def _collect_stats(self, subscriptions, meta):
         api_start = datetime.datetime.now()
         try:
-            if len(subscriptions) == 0:
-                return
-            names = []
+            # one batched request per metric choice, a name is only known to
+            # the API of its own choice (e.g. BGPv4 vs IS-IS)
+            groups = {}
+            for key in subscriptions:
+                sub = subscriptions[key]
+                groups.setdefault(sub.callback, {})[key] = sub
+            for callback, group in groups.items():
+                self.collect_group(callback, group, meta)
+        finally:
+            self.profile_logger.info(
+                "_collect_stats completed!", extra={
+                    'nanoseconds':  get_time_elapsed(api_start)
+                }
+            )
+
+    def get_fetch_lock(self, callback):
+        lock = self.fetch_locks.get(callback)
+        if lock is None:
+            lock = self.fetch_locks.setdefault(callback, Lock())
+        return lock
+
+    def get_stat_names(self, callback, subscriptions):
+        # union of the columns wanted for a batch, None to fetch them all as
+        # soon as one path wants the whole metric or a leaf the request
+        # cannot select, e.g. loss or port_tx of a flow
+        selectable = self.selectable_columns.get(callback)
+        if selectable is None:
+            return None
+        stat_names = set()
+        for sub in subscriptions:
+            if len(sub.subscribed_cols) == 0:
+                return None
+            stat_names.update(sub.subscribed_cols)
+        if not stat_names.issubset(selectable):
+            return None
+        return sorted(stat_names)
+
+    def get_chunks(self, names):
+        if self.fetch_chunk_size <= 0 or len(names) <= self.fetch_chunk_size:
+            return [names]
+        return [
+            names[index:index + self.fetch_chunk_size]
+            for index in range(0, len(names), self.fetch_chunk_size)
+        ]
+
+    def fetch_chunk(self, callback, names, stat_names):
+        try:
+            return callback(names, stat_names), None
+        except Exception as ex:
+            return None, ex
+
+    def fetch_chunks(self, callback, chunks, stat_names):
+        # returns a (metrics, error) pair per chunk, a failing chunk does not
+        # affect the others
+        if len(chunks) == 1:
+            return [self.fetch_chunk(callback, chunks[0], stat_names)]
+        futures = [
+            self.chunk_pool.submit(
+                self.fetch_chunk, callback, chunk, stat_names)
+            for chunk in chunks
+        ]
+        return [future.result() for future in futures]
+
+    def collect_group(self, callback, subscriptions, meta):
+        api_start = datetime.datetime.now()
+        names = []
+        try:
+            # a name may be subscribed at several paths, e.g. the metric
+            # and some of its leaves
             name_to_sub_reverse_map = {}
+            wildcards = []
+            polled = time.monotonic()
             for key in subscriptions:
                 sub = subscriptions[key]
                 sub.error = None
-                names.append(sub.name)
-                name_to_sub_reverse_map[sub.name] = sub
+                sub.last_polled = polled
+                if sub.wildcard:
+                    wildcards.append(sub)
+                    continue
+                if sub.name not in name_to_sub_reverse_map:
+                    names.append(sub.name)
+                    name_to_sub_reverse_map[sub.name] = []
+                name_to_sub_reverse_map[sub.name].append(sub)
+            stat_names = self.get_stat_names(
+                callback, list(subscriptions.values()))
+            if len(wildcards) > 0:
+                # no name asks the backend for all of them
+                names = []
+            # field holding the name in the metrics of this callback
+            key_name = sub.key
             # self.logger.info('Collect %s stats for %s', meta, names)
-            try:
-                metrics = sub.callback(names)
-                # self.logger.info('Collected %s stats for %s', meta, metrics)
-                for metric in metrics:
-                    key = getattr(metric, sub.key)
-                    if key not in name_to_sub_reverse_map:
+            updated = []
+            # a path may be fetched by its collector and on demand at the
+            # same time, the lock also keeps their stats updates apart
+            with self.get_fetch_lock(callback):
+                chunks = self.get_chunks(names)
+                results = self.fetch_chunks(callback, chunks, stat_names)
+                for chunk, (metrics, error) in zip(chunks, results):
+                    if error is not None:
+                        if len(wildcards) > 0:
+                            failed = list(subscriptions.values())
+                        else:
+                            failed = [
+                                sub
+                                for name in chunk
+                                for sub in name_to_sub_reverse_map[name]
+                            ]
+                        self.logger.error(
+                            'Failed to collect %s stats for %d paths: %s',
+                            meta,
+                            len(failed),
+                            error
+                        )
+                        for sub in failed:
+                            sub.update_error(str(error))
+                            updated.append(sub)
                         continue
-                    sub = name_to_sub_reverse_map[key]
-                    sub.prev_stats = sub.curr_stats
-                    sub.curr_stats = metric
-                    sub.compute_delta()
-                    sub.encode_stats(key)
-
-            except Exception as ex:
-                for key in subscriptions:
-                    sub.error = str(ex)
+                    # self.logger.info('Collected %s stats for %s', meta, metrics) # noqa
+                    children = [{} for _ in wildcards]
+                    for metric in metrics:
+                        key = getattr(metric, key_name)
+                        for index, wildcard in enumerate(wildcards):
+                            child = wildcard.get_child(key)
+                            child.last_polled = polled
+                            child.update_stats(metric)
+                            children[index][child.stringpath] = child
+                            updated.append(child)
+                        if key not in name_to_sub_reverse_map:
+                            continue
+                        for sub in name_to_sub_reverse_map[key]:
+                            sub.update_stats(metric)
+                            updated.append(sub)
+                    for index, wildcard in enumerate(wildcards):
+                        # names gone from the backend are dropped
+                        wildcard.children = children[index]
+                        wildcard.update_collected()
+                        updated.append(wildcard)
+
+            self.notify_sessions(updated)
 
         except Exception:
             self.logger.error(
@@ -429,75 +942,59 @@ class TestManager:
             self.logger.error("Fatal error: ", exc_info=True)
         finally:
             self.profile_logger.info(
-                "_collect_stats completed!", extra={
+                "collect_group completed!", extra={
                     'nanoseconds':  get_time_elapsed(api_start)
                 }
             )
 
-    def collect_flow_stats(self):
+    def notify_sessions(self, subscriptions):
         api_start = datetime.datetime.now()
         try:
-            global POLL_INTERVAL
-            self.logger.info('Started flow stats collection thread')
-            while self.stopped is False:
-                if len(self.flow_subscriptions) > 0:
-                    self.collect_stats(self.flow_subscriptions, 'Flow')
-                time.sleep(POLL_INTERVAL)
+            sessions = set()
+            for sub in subscriptions:
+                sample = sub.sample
+                for session in list(sub.subscribers.keys()):
+                    if session.mode != gnmi_pb2.SubscriptionList.Mode.STREAM:
+                        # ONCE and POLL are only sent what they fetched
+                        continue
+                    session.enqueue(sub.stringpath, sample)
+                    sessions.add(session)
+            for session in sessions:
+                session.notify()
         finally:
             self.profile_logger.info(
-                "collect_flow_stats completed!", extra={
+                "notify_sessions completed!", extra={
                     'nanoseconds':  get_time_elapsed(api_start)
                 }
             )
 
-    def collect_neighbor_states(self):
-        api_start = datetime.datetime.now()
-        try:
-            global POLL_INTERVAL
-            self.logger.info('Started neighbor states collection thread')
-            while self.stopped is False:
-                if len(self.neighbor_subscriptions) > 0:
-                    self.collect_stats(self.neighbor_subscriptions, 'Neighbor')
-                time.sleep(POLL_INTERVAL)
-        finally:
-            self.profile_logger.info(
-                "collect_neighbor_states completed!", extra={
-                    'nanoseconds':  get_time_elapsed(api_start)
-                }
-            )
+    def get_subscriptions(self, sub_type):
+        if sub_type == RequestType.PORT:
+            return self.port_subscriptions
+        if sub_type == RequestType.FLOW:
+            return self.flow_subscriptions
+        if sub_type == RequestType.NEIGHBOR:
+            return self.neighbor_subscriptions
+        if sub_type == RequestType.PROTOCOL:
+            return self.protocol_subscriptions
+        return None
+
+    def schedule_subscription(self, sub):
+        interval = sub.get_collection_interval(
+            self.engine.get_interval(sub.type))
+        if interval is None:
+            self.unschedule_subscription(sub)
+            return
+        self.engine.schedule(sub.type, sub.stringpath, interval)
 
-    def collect_port_stats(self):
-        api_start = datetime.datetime.now()
-        try:
-            global POLL_INTERVAL
-            self.logger.info('Started port stats collection thread')
-            while self.stopped is False:
-                if len(self.port_subscriptions) > 0:
-                    self.collect_stats(self.port_subscriptions, 'Port')
-                time.sleep(POLL_INTERVAL)
-        finally:
-            self.profile_logger.info(
-                "collect_port_stats completed!", extra={
-                    'nanoseconds':  get_time_elapsed(api_start)
-                }
-            )
+    def unschedule_subscription(self, sub):
+        self.engine.unschedule(sub.type, sub.stringpath)
 
-    def collect_protocol_stats(self):
-        api_start = datetime.datetime.now()
-        try:
-            global POLL_INTERVAL
-            time.sleep(POLL_INTERVAL)
-            self.logger.info('Started protocol stats collection thread')
-            while self.stopped is False:
-                if len(self.protocol_subscriptions) > 0:
-                    self.collect_stats(self.protocol_subscriptions, 'Protocol')
-                time.sleep(POLL_INTERVAL)
-        finally:
-            self.profile_logger.info(
-                "collect_protocol_stats completed!", extra={
-                    'nanoseconds':  get_time_elapsed(api_start)
-                }
-            )
+    def reschedule_subscriptions(self, sub_type):
+        # called by the engine, with the lock held, once the adaptive
+        # interval of a kind moved
+        for sub in list(self.get_subscriptions(sub_type).values()):
+            self.schedule_subscription(sub)
 
     def get_api(self):
         api_start = datetime.datetime.now()
@@ -514,14 +1011,18 @@ class TestManager:
                 self.app_mode,
                 target
             )
-            # when using ixnetwork extension, host is IxNetwork API Server
-
+            self.api_target = target
+            pool_size = self.backend_pool_size
             if self.app_mode == 'ixnetwork':
-                self.api = snappi.api(location=target, ext='ixnetwork')
+                # the extension keeps the IxNetwork session state in its
+                # api object, stick to one
+                pool_size = 1
             else:
                 global POLL_INTERVAL
                 POLL_INTERVAL = ATHENA_POLL_INTERVAL
-                self.api = snappi.api(location=target)
+            self.api = self.create_api()
+            self.api_pool = ApiPool(self.create_api, pool_size)
+            self.api_pool.add(self.api)
             self.logger.info('Initialized snappi...')
             return self.api
         finally:
@@ -531,15 +1032,39 @@ class TestManager:
                 }
             )
 
+    def create_api(self):
+        api_start = datetime.datetime.now()
+        try:
+            # when using ixnetwork extension, host is IxNetwork API Server
+            if self.app_mode == 'ixnetwork':
+                api = snappi.api(location=self.api_target, ext='ixnetwork')
+            else:
+                api = snappi.api(location=self.api_target)
+            if self.backend_timeout > 0 and \
+                    not set_api_timeout(api, self.backend_timeout):
+                self.logger.info(
+                    'No request timeout for the %s backend client',
+                    self.app_mode
+                )
+            return api
+        finally:
+            self.profile_logger.info(
+                "create_api completed!", extra={
+                    'nanoseconds':  get_time_elapsed(api_start)
+                }
+            )
+
     def get_flow_metric(self, flow_names, stat_names=None):
         api_start = datetime.datetime.now()
         try:
-            api = self.get_api()
-            req = api.metrics_request()
-            req.choice = "flow"
-            req.flow.flow_names = flow_names
-            res = api.get_metrics(req)
-            return res.flow_metrics
+            with self.api_pool.acquire() as api:
+                req = api.metrics_request()
+                req.choice = "flow"
+                req.flow.flow_names = flow_names
+                if stat_names is not None:
+                    req.flow.metric_names = stat_names
+                res = api.get_metrics(req)
+                return res.flow_metrics
         finally:
             self.profile_logger.info(
                 "get_flow_metric completed!", extra={
@@ -550,12 +1075,14 @@ class TestManager:
     def get_port_metric(self, port_names, stat_names=None):
         api_start = datetime.datetime.now()
         try:
-            api = self.get_api()
-            req = api.metrics_request()
-            req.choice = "port"
-            req.port.port_names = port_names
-            res = api.get_metrics(req)
-            return res.port_metrics
+            with self.api_pool.acquire() as api:
+                req = api.metrics_request()
+                req.choice = "port"
+                req.port.port_names = port_names
+                if stat_names is not None:
+                    req.port.column_names = stat_names
+                res = api.get_metrics(req)
+                return res.port_metrics
         finally:
             self.profile_logger.info(
                 "get_port_metric completed!", extra={
@@ -566,12 +1093,14 @@ class TestManager:
     def get_bgpv6_metric(self, peer_names, stat_names=None):
         api_start = datetime.datetime.now()
         try:
-            api = self.get_api()
-            req = api.metrics_request()
-            req.choice = "bgpv6"
-            req.bgpv6.peer_names = peer_names
-            res = api.get_metrics(req)
-            return res.bgpv6_metrics
+            with self.api_pool.acquire() as api:
+                req = api.metrics_request()
+                req.choice = "bgpv6"
+                req.bgpv6.peer_names = peer_names
+                if stat_names is not None:
+                    req.bgpv6.column_names = stat_names
+                res = api.get_metrics(req)
+                return res.bgpv6_metrics
         finally:
             self.profile_logger.info(
                 "get_bgpv6_metric completed!", extra={
@@ -582,12 +1111,14 @@ class TestManager:
     def get_bgpv4_metric(self, peer_names, stat_names=None):
         api_start = datetime.datetime.now()
         try:
-            api = self.get_api()
-            req = api.metrics_request()
-            req.choice = "bgpv4"
-            req.bgpv4.peer_names = peer_names
-            res = api.get_metrics(req)
-            return res.bgpv4_metrics
+            with self.api_pool.acquire() as api:
+                req = api.metrics_request()
+                req.choice = "bgpv4"
+                req.bgpv4.peer_names = peer_names
+                if stat_names is not None:
+                    req.bgpv4.column_names = stat_names
+                res = api.get_metrics(req)
+                return res.bgpv4_metrics
         finally:
             self.profile_logger.info(
                 "get_bgpv4_metric completed!", extra={
@@ -598,12 +1129,14 @@ class TestManager:
     def get_isis_metric(self, router_names, stat_names=None):
         api_start = datetime.datetime.now()
         try:
-            api = self.get_api()
-            req = api.metrics_request()
-            req.choice = "isis"
-            req.isis.router_names = router_names
-            res = api.get_metrics(req)
-            return res.isis_metrics
+            with self.api_pool.acquire() as api:
+                req = api.metrics_request()
+                req.choice = "isis"
+                req.isis.router_names = router_names
+                if stat_names is not None:
+                    req.isis.column_names = stat_names
+                res = api.get_metrics(req)
+                return res.isis_metrics
         finally:
             self.profile_logger.info(
                 "get_isis_metric completed!", extra={
@@ -614,12 +1147,12 @@ class TestManager:
     def get_ipv4_neighbor_state(self, eth_names, stat_names=None):
         api_start = datetime.datetime.now()
         try:
-            api = self.get_api()
-            req = api.states_request()
-            req.choice = "ipv4_neighbors"
-            req.ipv4_neighbors.ethernet_names = eth_names
-            res = api.get_states(req)
-            return res.ipv4_neighbors
+            with self.api_pool.acquire() as api:
+                req = api.states_request()
+                req.choice = "ipv4_neighbors"
+                req.ipv4_neighbors.ethernet_names = eth_names
+                res = api.get_states(req)
+                return res.ipv4_neighbors
         finally:
             self.profile_logger.info(
                 "get_ipv4_neighbor_state completed!", extra={
@@ -630,12 +1163,12 @@ class TestManager:
     def get_ipv6_neighbor_state(self, eth_names, stat_names=None):
         api_start = datetime.datetime.now()
         try:
-            api = self.get_api()
-            req = api.states_request()
-            req.choice = "ipv6_neighbors"
-            req.ipv6_neighbors.ethernet_names = eth_names
-            res = api.get_states(req)
-            return res.ipv6_neighbors
+            with self.api_pool.acquire() as api:
+                req = api.states_request()
+                req.choice = "ipv6_neighbors"
+                req.ipv6_neighbors.ethernet_names = eth_names
+                res = api.get_states(req)
+                return res.ipv6_neighbors
         finally:
             self.profile_logger.info(
                 "get_ipv6_neighbor_state completed!", extra={
@@ -670,6 +1203,48 @@ class TestManager:
                 }
             )
 
+    def encode_batch(self, updates):
+        """Packs the updates of one publish cycle into as few Notifications as
+        possible, all sharing the same timestamp, without letting any single
+        SubscribeResponse grow past max_notification_size bytes.
+        """
+        api_start = datetime.datetime.now()
+        try:
+            milliseconds = int(round(time.time() * 1000))
+            # framing around the updates: the timestamp field, then the tag
+            # and (at most 5 bytes) length prefix of the notification
+            overhead = 1 + get_varint_size(milliseconds) + 6
+            max_size = self.max_notification_size - overhead
+            responses = []
+            batch = []
+            batch_size = 0
+            for update in updates:
+                # payload plus field tag and length prefix
+                size = update.ByteSize()
+                update_size = 1 + get_varint_size(size) + size
+                if len(batch) > 0 and batch_size + update_size > max_size:
+                    responses.append(self.create_batch_response(
+                        milliseconds, batch))
+                    batch = []
+                    batch_size = 0
+                batch.append(update)
+                batch_size += update_size
+            if len(batch) > 0:
+                responses.append(self.create_batch_response(
+                    milliseconds, batch))
+            return responses
+        finally:
+            self.profile_logger.info(
+                "encode_batch completed!", extra={
+                    'nanoseconds':  get_time_elapsed(api_start)
+                }
+            )
+
+    def create_batch_response(self, timestamp, updates):
+        notification = gnmi_pb2.Notification(
+            timestamp=timestamp, update=updates)
+        return gnmi_pb2.SubscribeResponse(update=notification)
+
     def encode_sync(self):
         api_start = datetime.datetime.now()
         try:
@@ -705,10 +1280,11 @@ class TestManager:
             for path in self.port_subscriptions:
                 sub = self.port_subscriptions[path]
                 self.logger.info(
-                    '\t\tSubscriptions: %s, [Key: %s, Name: %s]',
+                    '\t\tSubscriptions: %s, [Key: %s, Name: %s, Refs: %s]',
                     path,
                     sub.key,
-                    sub.name
+                    sub.name,
+                    sub.refcount
                 )
 
             self.logger.info(
@@ -718,10 +1294,11 @@ class TestManager:
             for path in self.flow_subscriptions:
                 sub = self.flow_subscriptions[path]
                 self.logger.info(
-                    '\t\tSubscriptions: %s, [Key: %s, Name: %s]',
+                    '\t\tSubscriptions: %s, [Key: %s, Name: %s, Refs: %s]',
                     path,
                     sub.key,
-                    sub.name
+                    sub.name,
+                    sub.refcount
                 )
 
             self.logger.info(
@@ -730,10 +1307,11 @@ class TestManager:
             for path in self.neighbor_subscriptions:
                 sub = self.neighbor_subscriptions[path]
                 self.logger.info(
-                    '\t\tSubscriptions: %s, [Key: %s, Name: %s]',
+                    '\t\tSubscriptions: %s, [Key: %s, Name: %s, Refs: %s]',
                     path,
                     sub.key,
-                    sub.name
+                    sub.name,
+                    sub.refcount
                 )
 
             self.logger.info(
@@ -743,10 +1321,11 @@ class TestManager:
             for path in self.protocol_subscriptions:
                 sub = self.protocol_subscriptions[path]
                 self.logger.info(
-                    '\t\tSubscriptions: %s, [Key: %s, Name: %s]',
+                    '\t\tSubscriptions: %s, [Key: %s, Name: %s, Refs: %s]',
                     path,
                     sub.key,
-                    sub.name
+                    sub.name,
+                    sub.refcount
                 )
         finally:
             self.profile_logger.info(
@@ -765,31 +1344,24 @@ class TestManager:
                 for request in session.requests:
                     if request is None:
                         continue
+                    if request.HasField('poll'):
+                        session.pending_polls += 1
+                        continue
                     session.mode = request.subscribe.mode
                     for subscription in request.subscribe.subscription:
-                        sub = SubscriptionReq(
-                            request.subscribe, session, subscription)
-                        sub.client.register_path(sub.stringpath)
-                        sub.encoding = request.subscribe.encoding
-                        self.logger.info(
-                            'Register Subscription %s', sub.stringpath)
-                        if sub.type == RequestType.PORT:
-                            self.port_subscriptions[sub.stringpath] = sub
-                        elif sub.type == RequestType.FLOW:
-                            self.flow_subscriptions[sub.stringpath] = sub
-                        elif sub.type == RequestType.NEIGHBOR:
-                            self.neighbor_subscriptions[sub.stringpath] = sub
-                        elif sub.type == RequestType.PROTOCOL:
-                            self.protocol_subscriptions[sub.stringpath] = sub
-                        else:
-                            self.logger.info(
-                                'Unknown Subscription %s', sub.stringpath)
+                        self.add_subscriber(
+                            session, request.subscribe, subscription)
+                if session.mode == gnmi_pb2.SubscriptionList.Mode.POLL:
+                    # the initial snapshot is answered like a first Poll
+                    session.pending_polls += 1
             except Exception as ex:
                 self.logger.error('Exception: %s', str(ex))
                 self.logger.error('Exception: ', exc_info=True)
 
-            self.dump_all_subscription()
             self.lock.release()
+            if session.mode == gnmi_pb2.SubscriptionList.Mode.STREAM:
+                self.fetch_missing_samples(session)
+            self.dump_all_subscription()
         finally:
             self.profile_logger.info(
                 "register_subscription completed!", extra={
@@ -797,39 +1369,209 @@ class TestManager:
                 }
             )
 
+    async def start_request_reader(self, session, request_iterator):
+        """Keeps consuming the requests of a live stream in the background
+        so the client can poll, or change its subscriptions, without opening
+        a new stream.
+        """
+        api_start = datetime.datetime.now()
+        try:
+            if isinstance(request_iterator, types.GeneratorType):
+                # already drained by parse_requests
+                session.requests_done = True
+                return
+            session.reader = asyncio.ensure_future(
+                self.read_requests(session, request_iterator))
+        finally:
+            self.profile_logger.info(
+                "start_request_reader completed!", extra={
+                    'nanoseconds':  get_time_elapsed(api_start)
+                }
+            )
+
+    async def read_requests(self, session, request_iterator):
+        try:
+            while self.stopped is False:
+                request = await request_iterator.__anext__()
+                if request.HasField('poll'):
+                    session.pending_polls += 1
+                elif request.HasField('subscribe'):
+                    await self.update_subscription(session, request.subscribe)
+                session.notify()
+        except StopAsyncIteration:
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            self.logger.error('Exception: %s', str(ex))
+            self.logger.error('Exception: ', exc_info=True)
+        finally:
+            session.requests_done = True
+            session.notify()
+
+    async def update_subscription(self, session, subscriptionList):
+        """Applies a SubscriptionList received on a live stream as a diff:
+        paths no longer listed are detached, new ones attached and the ones
+        whose options changed re-attached. Untouched paths keep their
+        publishing state.
+        """
+        api_start = datetime.datetime.now()
+        try:
+            wanted = {}
+            for subscription in subscriptionList.subscription:
+                wanted[gnmi_path_to_string(subscription)[0]] = subscription
+            added = 0
+            removed = 0
+            self.lock.acquire()
+            try:
+                for stringpath in list(session.subscriptions.keys()):
+                    if stringpath not in wanted:
+                        self.remove_subscriber(session, stringpath)
+                        removed += 1
+                for stringpath, subscription in wanted.items():
+                    session_sub = session.subscriptions.get(stringpath)
+                    if session_sub is not None:
+                        if session_sub.has_options(
+                                subscriptionList, subscription):
+                            continue
+                        self.remove_subscriber(session, stringpath)
+                    self.add_subscriber(
+                        session, subscriptionList, subscription)
+                    added += 1
+            except Exception as ex:
+                self.logger.error('Exception: %s', str(ex))
+                self.logger.error('Exception: ', exc_info=True)
+            self.lock.release()
+            self.logger.info(
+                'Updated Subscription for %s: %s attached, %s detached',
+                session.context,
+                added,
+                removed
+            )
+            if session.mode == gnmi_pb2.SubscriptionList.Mode.STREAM:
+                self.fetch_missing_samples(session)
+            self.dump_all_subscription()
+        finally:
+            self.profile_logger.info(
+                "update_subscription completed!", extra={
+                    'nanoseconds':  get_time_elapsed(api_start)
+                }
+            )
+
+    def fetch_missing_samples(self, session):
+        """Starts an out of cycle fetch of the session paths never collected
+        so far, their first update and the sync_response do not have to wait
+        for the collectors. Paths already collected are sent from the cache
+        by add_subscriber.
+        """
+        api_start = datetime.datetime.now()
+        try:
+            groups = {}
+            for session_sub in list(session.subscriptions.values()):
+                sub = session_sub.sub
+                if sub.sample is None:
+                    groups.setdefault(sub.callback, []).append(sub)
+            for callback, subs in groups.items():
+                asyncio.ensure_future(self.fetch_in_background(callback, subs))
+        finally:
+            self.profile_logger.info(
+                "fetch_missing_samples completed!", extra={
+                    'nanoseconds':  get_time_elapsed(api_start)
+                }
+            )
+
+    async def fetch_in_background(self, callback, subs):
+        try:
+            await self.fetch_coalescer.request(callback, subs)
+        except Exception as ex:
+            self.logger.error('Exception: %s', str(ex))
+
+    def add_subscriber(self, session, subscriptionList, subscription):
+        api_start = datetime.datetime.now()
+        try:
+            stringpath = gnmi_path_to_string(subscription)[0]
+            subscriptions = self.get_subscriptions(
+                get_subscription_type(stringpath))
+            if subscriptions is None:
+                self.logger.info('Unknown Subscription %s', stringpath)
+                return None
+            sub = subscriptions.get(stringpath)
+            if sub is None:
+                sub = SubscriptionReq(subscription)
+                subscriptions[stringpath] = sub
+                self.logger.info('Register Subscription %s', stringpath)
+            session_sub = SessionSubscription(
+                sub, session, subscriptionList, subscription)
+            sub.add_subscriber(session_sub)
+            session.register_path(stringpath, session_sub)
+            if sub.sample is not None and \
+                    session.mode == gnmi_pb2.SubscriptionList.Mode.STREAM:
+                # already collected for another session, no need to wait
+                # for the next cycle to send it
+                for path, sample in sub.get_samples():
+                    session.enqueue(path, sample)
+                session.notify()
+            self.logger.info(
+                'Attached session to Subscription %s [Refs: %s]',
+                stringpath,
+                sub.refcount
+            )
+            self.schedule_subscription(sub)
+            return sub
+        finally:
+            self.profile_logger.info(
+                "add_subscriber completed!", extra={
+                    'nanoseconds':  get_time_elapsed(api_start)
+                }
+            )
+
+    def remove_subscriber(self, session, stringpath):
+        api_start = datetime.datetime.now()
+        try:
+            session_sub = session.subscriptions.get(stringpath)
+            session.deregister_path(stringpath)
+            if session_sub is None:
+                return
+            sub = session_sub.sub
+            sub.remove_subscriber(session)
+            self.logger.info(
+                'Detached session from Subscription %s [Refs: %s]',
+                stringpath,
+                sub.refcount
+            )
+            if sub.refcount > 0:
+                self.schedule_subscription(sub)
+                return
+            subscriptions = self.get_subscriptions(sub.type)
+            if subscriptions.get(stringpath) is sub:
+                subscriptions.pop(stringpath)
+            self.unschedule_subscription(sub)
+            self.logger.info('Deregister Subscription %s', stringpath)
+        finally:
+            self.profile_logger.info(
+                "remove_subscriber completed!", extra={
+                    'nanoseconds':  get_time_elapsed(api_start)
+                }
+            )
+
     async def deregister_subscription(self, session):
         api_start = datetime.datetime.now()
         try:
+            session.stop_reading()
             self.lock.acquire()
 
             self.logger.info(
                 'Deregister Subscription for %s elements', len(
-                    session.requests))
+                    session.subscriptions))
             try:
-                for request in session.requests:
-                    if request is None:
-                        continue
-                    session.mode = request.subscribe.mode
-                    for subscription in request.subscribe.subscription:
-                        sub = SubscriptionReq(
-                            request.subscribe, session, subscription)
-                        sub.client.deregister_path(sub.stringpath)
-                        self.logger.info(
-                            'Deregister Subscription %s', sub.stringpath)
-                        if sub.type == RequestType.PORT:
-                            self.port_subscriptions.pop(sub.stringpath)
-                        elif sub.type == RequestType.FLOW:
-                            self.flow_subscriptions.pop(sub.stringpath)
-                        elif sub.type == RequestType.NEIGHBOR:
-                            self.neighbor_subscriptions.pop(sub.stringpath)
-                        elif sub.type == RequestType.PROTOCOL:
-                            self.protocol_subscriptions.pop(sub.stringpath)
+                for stringpath in list(session.subscriptions.keys()):
+                    self.remove_subscriber(session, stringpath)
             except Exception as ex:
                 self.logger.error('Exception: %s', str(ex))
                 self.logger.error('Exception: ', exc_info=True)
 
-            self.dump_all_subscription()
             self.lock.release()
+            self.dump_all_subscription()
             # self.stop_worker_threads()
 
         finally:
@@ -839,44 +1581,239 @@ class TestManager:
                 }
             )
 
-    async def publish_stats(self, session):
+    async def get_stats(self, request):
+        """Serves a GetRequest from samples younger than get_max_staleness,
+        the other paths being fetched once for all concurrent callers.
+        Returns the response, the status code and the error message if any.
+        """
         api_start = datetime.datetime.now()
         try:
-            results = []
+            if request.encoding not in [gnmi_pb2.Encoding.JSON,
+                                        gnmi_pb2.Encoding.JSON_IETF,
+                                        gnmi_pb2.Encoding.PROTO]:
+                return None, grpc.StatusCode.UNIMPLEMENTED, \
+                    'Unsupported encoding {}'.format(request.encoding)
+
+            self.evict_get_subscriptions()
+            subs = []
+            for path in request.path:
+                subscription = gnmi_pb2.Subscription(path=gnmi_pb2.Path(
+                    elem=list(request.prefix.elem) + list(path.elem)))
+                stringpath = gnmi_path_to_string(subscription)[0]
+                if self.get_callback(stringpath) is None:
+                    return None, grpc.StatusCode.NOT_FOUND, \
+                        'Unknown path {}'.format(stringpath)
+                subscriptions = self.get_subscriptions(
+                    get_subscription_type(stringpath))
+                sub = subscriptions.get(stringpath)
+                if sub is not None:
+                    # registered since, the cached copy would go stale
+                    self.get_subscriptions_cache.pop(stringpath, None)
+                else:
+                    sub = self.get_subscriptions_cache.get(stringpath)
+                if sub is None:
+                    sub = SubscriptionReq(subscription)
+                    self.get_subscriptions_cache[stringpath] = sub
+                subs.append(sub)
+
+            now = time.monotonic()
+            groups = {}
+            for sub in subs:
+                sample = sub.sample
+                if sample is not None and sample.error is None and \
+                        sample.polled is not None and \
+                        now - sample.polled <= self.get_max_staleness:
+                    continue
+                groups.setdefault(sub.callback, []).append(sub)
+            await asyncio.gather(*[
+                self.fetch_coalescer.request(callback, group)
+                for callback, group in groups.items()
+            ])
 
-            def publish(key, subscriptions, session, res, meta=None):
-                # self.logger.info('Publish %s Stats %s', meta, key)
-                sub = subscriptions[key]
+            notifications = []
+            for sub in subs:
+                sample = sub.sample
+                if sample is None:
+                    return None, grpc.StatusCode.NOT_FOUND, \
+                        'No stats for {}'.format(sub.stringpath)
+                if sample.error is not None:
+                    return None, grpc.StatusCode.UNAVAILABLE, \
+                        '{}: {}'.format(sub.name, sample.error)
+                if sub.wildcard:
+                    for child in list(sub.children.values()):
+                        encoded = child.encode_stats(request.encoding)
+                        if encoded is not None:
+                            notifications.append(encoded.update)
+                    continue
+                encoded = sub.encode_stats(request.encoding, sample=sample)
+                if encoded is None:
+                    return None, grpc.StatusCode.NOT_FOUND, \
+                        'No stats for {}'.format(sub.stringpath)
+                notifications.append(encoded.update)
+            return gnmi_pb2.GetResponse(notification=notifications), \
+                grpc.StatusCode.OK, None
+        finally:
+            self.profile_logger.info(
+                "get_stats completed!", extra={
+                    'nanoseconds':  get_time_elapsed(api_start)
+                }
+            )
+
+    def evict_get_subscriptions(self):
+        # drops the paths whose sample is too old to serve a Get, at most
+        # once per get_max_staleness. Paths still being fetched for the
+        # first time are kept, a concurrent Get waits on them.
+        now = time.monotonic()
+        if now - self.get_cache_swept < self.get_max_staleness:
+            return
+        self.get_cache_swept = now
+        for stringpath in [
+                stringpath
+                for stringpath, sub in self.get_subscriptions_cache.items()
+                if sub.last_polled is not None and
+                now - sub.last_polled > self.get_max_staleness]:
+            self.get_subscriptions_cache.pop(stringpath)
+
+    async def wait_for_poll(self, session):
+        """Returns True once the client sent a Poll request, False when the
+        request stream ended.
+        """
+        api_start = datetime.datetime.now()
+        try:
+            while self.stopped is False:
+                if session.pending_polls > 0:
+                    session.pending_polls -= 1
+                    return True
+                if session.requests_done:
+                    return False
+                await session.wait_for_stats(NOTIFY_TIMEOUT)
+            return False
+        finally:
+            self.profile_logger.info(
+                "wait_for_poll completed!", extra={
+                    'nanoseconds':  get_time_elapsed(api_start)
+                }
+            )
 
-                if sub.error is not None:
-                    res.append(self.create_error_response(
-                        sub.name, sub.error))
-                    return
+    async def poll_session(self, session):
+        """Fetches the paths of a POLL session on demand and queues the
+        fresh samples, followed by a sync_response.
+        """
+        api_start = datetime.datetime.now()
+        try:
+            await self.refresh_session(session)
+        finally:
+            self.profile_logger.info(
+                "poll_session completed!", extra={
+                    'nanoseconds':  get_time_elapsed(api_start)
+                }
+            )
 
-                if sub.encoded_stats is not None:
-                    res.append(sub.encoded_stats)
-                    sub.client.update_stats(key)
+    async def once_session(self, session):
+        """ONCE fast path: answers right away from samples collected less
+        than get_max_staleness ago, like Get, fetching only the other paths
+        instead of waiting for the next collection cycle.
+        """
+        api_start = datetime.datetime.now()
+        try:
+            await self.refresh_session(session, self.get_max_staleness)
+        finally:
+            self.profile_logger.info(
+                "once_session completed!", extra={
+                    'nanoseconds':  get_time_elapsed(api_start)
+                }
+            )
 
-            self.lock.acquire()
-            for key in self.port_subscriptions:
-                publish(key, self.port_subscriptions, session, results, 'Port')
-
-            for key in self.flow_subscriptions:
-                publish(key, self.flow_subscriptions, session, results, 'Flow')
-
-            for key in self.neighbor_subscriptions:
-                publish(
-                    key,
-                    self.neighbor_subscriptions,
-                    session,
-                    results,
-                    'Neighbor'
-                )
+    async def refresh_session(self, session, max_age=None):
+        """Queues a sample of every path of the session followed by a
+        sync_response. Samples older than max_age seconds (all of them when
+        max_age is None) are fetched again, concurrent refreshes of the same
+        metric kind being served by shared backend calls.
+        """
+        now = time.monotonic()
+        subs = [
+            session_sub.sub
+            for session_sub in list(session.subscriptions.values())
+        ]
+        groups = {}
+        for sub in subs:
+            sample = sub.sample
+            if max_age is not None and sample is not None and \
+                    sample.error is None and sample.polled is not None and \
+                    now - sample.polled <= max_age:
+                continue
+            groups.setdefault(sub.callback, []).append(sub)
+        await asyncio.gather(*[
+            self.fetch_coalescer.request(callback, group)
+            for callback, group in groups.items()
+        ])
+        for sub in subs:
+            for path, sample in sub.get_samples():
+                session.enqueue(path, sample)
+        session.request_sync()
+
+    def fetch_subscriptions(self, subscriptions):
+        """Out of cycle fetch of subscriptions sharing the same callback.
+        """
+        self.collect_stats(
+            {sub.stringpath: sub for sub in subscriptions},
+            'On demand'
+        )
 
-            for key in self.protocol_subscriptions:
-                publish(key, self.protocol_subscriptions,
-                        session, results, 'Protocol')
-            self.lock.release()
+    async def publish_stats(self, session, serialized=False):
+        """Returns the responses due for the session. With serialized set,
+        updates are returned as pre-serialized bytes shared by all the
+        sessions subscribed to the same path and encoding.
+        """
+        api_start = datetime.datetime.now()
+        try:
+            results = []
+            updates = []
+            # batched notifications are specific to a session, there is
+            # nothing to share
+            serialized = serialized and not self.batch_updates
+
+            # only visit the samples queued for this session, shared paths
+            # are encoded once by the collectors and fanned out from there.
+            # Samples are immutable snapshots, no lock is needed to read them.
+            for key, sample in session.queue.drain():
+                session_sub = session.get_subscription(key)
+                if session_sub is None:
+                    session_sub = self.get_child_subscription(session, key)
+                if session_sub is None or sample is None or \
+                        session.is_published(key, sample.generation):
+                    continue
+                sub = session_sub.sub
+                if sample.error is not None:
+                    session.mark_published(key, sample.generation)
+                    results.append(self.create_error_response(
+                        sub.name, sample.error))
+                    continue
+                if sub.wildcard:
+                    # every key was collected and queued ahead, the keys
+                    # it no longer has are dropped from the session too
+                    session.mark_published(key, sample.generation)
+                    session.prune_children(key, sub.children)
+                    session.update_stats(key)
+                    continue
+                if not session_sub.sample_due(sample):
+                    continue
+                missed = session_sub.missed_samples(sample)
+                session.mark_published(key, sample.generation)
+                session_sub.last_sample = sample.polled
+
+                encoded_stats = session_sub.get_encoded_stats(
+                    sample, serialized, missed)
+                if encoded_stats is not None:
+                    session_sub.last_yield = time.time()
+                    if self.batch_updates:
+                        updates.extend(encoded_stats.update.update)
+                    else:
+                        results.append(encoded_stats)
+                    session.update_stats(session_sub.path)
+
+            if len(updates) > 0:
+                results.extend(self.encode_batch(updates))
 
             if session.send_sync():
                 results.append(self.encode_sync())
@@ -890,6 +1827,29 @@ class TestManager:
                 }
             )
 
+    def get_child_subscription(self, session, stringpath):
+        # first sample of a key of a wildcard path for this session
+        for session_sub in list(session.subscriptions.values()):
+            if not session_sub.sub.wildcard:
+                continue
+            child = session_sub.sub.children.get(stringpath)
+            if child is not None:
+                child_sub = session_sub.get_child(child)
+                session.children[stringpath] = child_sub
+                return child_sub
+        return None
+
+    async def wait_for_stats(self, session):
+        api_start = datetime.datetime.now()
+        try:
+            await session.wait_for_stats(NOTIFY_TIMEOUT)
+        finally:
+            self.profile_logger.info(
+                "wait_for_stats completed!", extra={
+                    'nanoseconds':  get_time_elapsed(api_start)
+                }
+            )
+
     async def keep_polling(self):
         api_start = datetime.datetime.now()
         try:
@@ -0,0 +1,112 @@
+# response_logger.py
+import logging
+import time
+
+from ..autogen import gnmi_pb2
+
+
+def path_to_string(path):
+    elems = []
+    for elem in path.elem:
+        keys = ''.join(
+            '[{}={}]'.format(key, elem.key[key]) for key in sorted(elem.key)
+        )
+        elems.append(elem.name + keys)
+    return '/' + '/'.join(elems)
+
+
+def value_to_string(val):
+    if val.HasField('json_val'):
+        return val.json_val.decode('utf-8')
+    if val.HasField('json_ietf_val'):
+        return val.json_ietf_val.decode('utf-8')
+    if val.HasField('any_val'):
+        return val.any_val.type_url
+    return str(val).strip()
+
+
+def parse_response(response):
+    if isinstance(response, bytes):
+        return gnmi_pb2.SubscribeResponse.FromString(response)
+    return response
+
+
+class LazyResponse(object):
+    """Defers formatting of a SubscribeResponse until a log record is
+    actually emitted.
+    """
+    __slots__ = ('response',)
+
+    def __init__(self, response):
+        self.response = response
+
+    def __str__(self):
+        response = parse_response(self.response)
+        if response.HasField('update'):
+            updates = [
+                '{}: {}'.format(
+                    path_to_string(update.path), value_to_string(update.val))
+                for update in response.update.update
+            ]
+            return 'update - ' + ', '.join(updates)
+        if response.HasField('sync_response'):
+            return 'sync_response - {}'.format(response.sync_response)
+        if response.HasField('error'):
+            return 'error - {}'.format(response.error.message)
+        return str(response)
+
+
+class ResponseLogger(object):
+    """Logs the responses sent on Subscribe streams.
+
+    Nothing is formatted unless the logger is enabled for `level`. Then
+    either 1 in `sample_rate` responses is logged in full, or, when
+    `summary_interval` is set, only a per path count of updates is logged
+    every `summary_interval` seconds.
+    """
+
+    def __init__(self, logger, level=logging.DEBUG, sample_rate=1,
+                 summary_interval=0):
+        self.logger = logger
+        self.level = level
+        self.sample_rate = max(1, sample_rate)
+        self.summary_interval = summary_interval
+        self.counter = 0
+        self.summary = {}
+        self.last_summary = time.time()
+
+    def log(self, index, response):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        if self.summary_interval > 0:
+            self.add_to_summary(response)
+            return
+        self.counter += 1
+        if self.counter % self.sample_rate != 0:
+            return
+        self.logger.log(
+            self.level, 'Response[%s]: %s', index, LazyResponse(response))
+
+    def add_to_summary(self, response):
+        response = parse_response(response)
+        if response.HasField('update'):
+            for update in response.update.update:
+                path = path_to_string(update.path)
+                self.summary[path] = self.summary.get(path, 0) + 1
+        elif response.HasField('error'):
+            self.summary['error'] = self.summary.get('error', 0) + 1
+
+        now = time.time()
+        elapsed = now - self.last_summary
+        if elapsed < self.summary_interval:
+            return
+        for path in sorted(self.summary):
+            self.logger.log(
+                self.level,
+                'Responses in last %.1fs: %s - %s',
+                elapsed,
+                path,
+                self.summary[path]
+            )
+        self.summary = {}
+        self.last_summary = now
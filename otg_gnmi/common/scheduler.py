@@ -0,0 +1,114 @@
+# scheduler.py
+import math
+
+
+class TimerWheel(object):
+    """Hashed timer wheel used by the collectors to decide which
+    subscriptions are due for a backend fetch.
+
+    Members are grouped by their interval (expressed in ticks of
+    `resolution` seconds). Every group fires on the ticks that are multiples
+    of its interval, so groups whose intervals align (e.g. 100ms and 1s)
+    become due on the same tick and are served by a single fetch.
+    """
+
+    def __init__(self, resolution):
+        self.resolution = resolution
+        self.slots = {}  # tick -> set of group intervals (in ticks)
+        self.groups = {}  # group interval (in ticks) -> set of members
+        self.members = {}  # member -> group interval (in ticks)
+
+    def to_ticks(self, interval):
+        return max(1, int(round(interval / self.resolution)))
+
+    def current_tick(self, now):
+        return int(math.floor(now / self.resolution))
+
+    def add(self, member, interval, now):
+        ticks = self.to_ticks(interval)
+        if self.members.get(member) == ticks:
+            return
+        self.remove(member)
+        self.members[member] = ticks
+        group = self.groups.get(ticks)
+        if group is None:
+            group = set()
+            self.groups[ticks] = group
+            # the first sample of a new member is fetched out of cycle by
+            # the caller, the group starts on its next aligned tick
+            next_tick = (self.current_tick(now) // ticks + 1) * ticks
+            self.slots.setdefault(next_tick, set()).add(ticks)
+        group.add(member)
+
+    def remove(self, member):
+        ticks = self.members.pop(member, None)
+        if ticks is None:
+            return
+        group = self.groups[ticks]
+        group.discard(member)
+        if len(group) == 0:
+            # slots still referring to this group are dropped lazily
+            self.groups.pop(ticks)
+
+    def pop_due(self, now):
+        tick = self.current_tick(now)
+        fired = set()
+        for slot in [s for s in self.slots if s <= tick]:
+            fired.update(self.slots.pop(slot))
+        due = set()
+        for ticks in fired:
+            group = self.groups.get(ticks)
+            if group is None:
+                continue
+            due.update(group)
+            next_tick = (tick // ticks + 1) * ticks
+            self.slots.setdefault(next_tick, set()).add(ticks)
+        return due
+
+    def next_due(self, now):
+        """Seconds until the next slot fires, None if nothing is scheduled.
+        """
+        if len(self.slots) == 0:
+            return None
+        return max(0, min(self.slots) * self.resolution - now)
+
+    def __len__(self):
+        return len(self.members)
+
+
+class AdaptiveInterval(object):
+    """Collection interval of a metric kind following the backend latency.
+
+    Every measured round trip updates an exponentially weighted moving
+    average of the latency. The interval is that average times `headroom`,
+    clamped to [floor, ceiling]: it backs off when the backend slows down
+    and tightens again when it is fast.
+    """
+
+    def __init__(self, initial, floor, ceiling, headroom=4, weight=0.3,
+                 tolerance=0.2):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.headroom = headroom
+        self.weight = weight
+        # relative change below which a new interval is not worth a
+        # reschedule
+        self.tolerance = tolerance
+        self.latency = None
+        self.interval = self.clamp(initial)
+
+    def clamp(self, interval):
+        return min(self.ceiling, max(self.floor, interval))
+
+    def record(self, latency):
+        """Returns True when the interval moved enough to reschedule.
+        """
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.weight * (latency - self.latency)
+        interval = self.clamp(self.latency * self.headroom)
+        if abs(interval - self.interval) <= self.tolerance * self.interval:
+            return False
+        self.interval = interval
+        return True
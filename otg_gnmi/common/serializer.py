@@ -0,0 +1,89 @@
+# serializer.py
+import json
+import math
+
+from snappi.snappi import OpenApiIter, OpenApiObject
+
+try:
+    import orjson
+    # floats are written through orjson.Fragment, added in orjson 3.9
+    orjson.Fragment
+except (ImportError, AttributeError):
+    orjson = None
+
+
+def to_dict(obj, float_format=None):
+    """Same dict as snappi's _encode() (int64 values as strings, None values
+    left out) without re-validating every property: metrics come from a
+    response snappi already deserialized. Plain dicts, e.g. the delta of two
+    samples, are encoded value by value. Floats are replaced by
+    `float_format(value)` when given.
+    """
+    if isinstance(obj, OpenApiIter):
+        return [to_dict(item, float_format) for item in obj]
+    if isinstance(obj, dict):
+        properties = obj
+        types = {}
+    else:
+        properties = obj._properties
+        types = obj._TYPES
+    output = {}
+    for key, value in properties.items():
+        if isinstance(value, (OpenApiObject, OpenApiIter)):
+            output[key] = to_dict(value, float_format)
+        elif value is not None:
+            if types.get(key, {}).get('format') == 'int64':
+                value = str(value)
+            elif float_format is not None and type(value) is float:
+                value = float_format(value)
+            output[key] = value
+    return output
+
+
+class JsonSerializer(object):
+    """Compact JSON with sorted keys, UTF-8 encoded.
+    """
+    name = 'json'
+
+    def encode(self, obj):
+        return self.dumps(to_dict(obj))
+
+    def dumps(self, data):
+        return json.dumps(
+            data,
+            separators=(',', ':'),
+            sort_keys=True,
+            ensure_ascii=False
+        ).encode('utf-8')
+
+
+def format_float(value):
+    # the text json writes, orjson writes e.g. 0.00001 for 1e-05
+    if math.isfinite(value):
+        return orjson.Fragment(float.__repr__(value))
+    return orjson.Fragment(json.dumps(value))
+
+
+class OrjsonSerializer(object):
+    """Same bytes as JsonSerializer, produced by orjson. Floats are
+    formatted the way json does by `encode`, `dumps` leaves them to orjson.
+    """
+    name = 'orjson'
+
+    def encode(self, obj):
+        return self.dumps(to_dict(obj, format_float))
+
+    def dumps(self, data):
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+
+
+def get_serializer(name=None):
+    """Serializer by name, the fastest one installed when name is None.
+    """
+    if name is None:
+        name = 'json' if orjson is None else 'orjson'
+    if name == 'orjson':
+        if orjson is None:
+            raise Exception('orjson is not installed')
+        return OrjsonSerializer()
+    return JsonSerializer()
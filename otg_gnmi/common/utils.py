@@ -82,6 +82,10 @@ def init_logging(
     return logger
 
 
+def get_log_level(name):
+    return getattr(logging, name.upper(), logging.INFO)
+
+
 def is_none_or_empty(data):
     if data is None or len(data) == 0:
         return True
@@ -140,6 +144,55 @@ def gnmi_path_to_string(subscription):
     return path, name, sub_key
 
 
+def get_subscribed_columns(path):
+    # column named by the element following the keyed one, e.g. frames_rx
+    # for /flow_metrics[name=F1]/frames_rx. Empty when the whole metric is
+    # subscribed.
+    keyed = False
+    for ele in path.elem:
+        if ele.key is not None and len(ele.key) > 0:
+            keyed = True
+        elif keyed:
+            return [ele.name]
+    return []
+
+
+def get_selectable_columns(request_class):
+    # column names a snappi metrics request accepts in its metric_names or
+    # column_names, held by its upper case constants next to the
+    # serialization formats
+    return set(
+        getattr(request_class, attr) for attr in dir(request_class)
+        if attr.isupper() and not attr.startswith('_') and
+        attr not in ('DICT', 'JSON', 'YAML')
+    )
+
+
+def get_varint_size(value):
+    # bytes taken by a protobuf varint, e.g. a length prefix
+    size = 1
+    while value > 0x7f:
+        value >>= 7
+        size += 1
+    return size
+
+
+def get_typed_value(value):
+    """TypedValue of a scalar metric leaf, None for anything else.
+    """
+    if isinstance(value, bool):
+        return gnmi_pb2.TypedValue(bool_val=value)
+    if isinstance(value, int):
+        if value < 0:
+            return gnmi_pb2.TypedValue(int_val=value)
+        return gnmi_pb2.TypedValue(uint_val=value)
+    if isinstance(value, float):
+        return gnmi_pb2.TypedValue(double_val=value)
+    if isinstance(value, str):
+        return gnmi_pb2.TypedValue(string_val=value)
+    return None
+
+
 def get_subscription_type(path):
     if path.find(RequestPathBase.BASE_PORT_PATH) != -1:
         return RequestType.PORT
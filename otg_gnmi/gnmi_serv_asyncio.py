@@ -1,14 +1,14 @@
 # gnmi_serv_asyncio.py
 
 import datetime
-import logging
 
 import grpc
 
 from .autogen import gnmi_pb2, gnmi_pb2_grpc
 from .common.ixnutils import TestManager
-from .common.utils import (get_subscription_mode_string, get_time_elapsed,
-                           init_logging)
+from .common.response_logger import ResponseLogger
+from .common.utils import (get_log_level, get_subscription_mode_string,
+                           get_time_elapsed, init_logging)
 
 
 class ServerOptions(object):
@@ -19,7 +19,67 @@ class ServerOptions(object):
         self.target_address = "{}:{}".format(
             args.target_host, args.target_port)
         self.no_stdout = args.no_stdout
-        self.log_level = logging.DEBUG
+        self.log_level = get_log_level(args.log_level)
+        self.response_log_level = get_log_level(args.response_log_level)
+        self.response_log_sample = args.response_log_sample
+        self.response_log_summary = args.response_log_summary
+        self.batch_updates = args.batch_updates
+        self.max_notification_size = args.max_notification_size
+        self.session_queue_size = args.session_queue_size
+        self.slow_consumer_policy = args.slow_consumer_policy
+        self.get_max_staleness = args.get_max_staleness
+        self.collector_workers = args.collector_workers
+        self.min_poll_interval = args.min_poll_interval
+        self.max_poll_interval = args.max_poll_interval
+        self.fetch_chunk_size = args.fetch_chunk_size
+        self.fetch_max_inflight = args.fetch_max_inflight
+        self.backend_pool_size = args.backend_pool_size
+        self.backend_timeout = args.backend_timeout
+        self.leaf_updates = args.leaf_updates
+        self.deadband = args.deadband
+        self.counter_rate_change = args.counter_rate_change
+        self.counter_rate_tolerance = args.counter_rate_tolerance
+
+
+def serialize_response(response):
+    """Subscribe response serializer passing through responses that were
+    already serialized once and shared between streams.
+    """
+    if isinstance(response, bytes):
+        return response
+    return response.SerializeToString()
+
+
+def add_gnmi_servicer_to_server(servicer, server):
+    """Same as gnmi_pb2_grpc.add_gNMIServicer_to_server, except that
+    Subscribe may yield pre-serialized responses.
+    """
+    rpc_method_handlers = {
+        'Capabilities': grpc.unary_unary_rpc_method_handler(
+            servicer.Capabilities,
+            request_deserializer=gnmi_pb2.CapabilityRequest.FromString,
+            response_serializer=gnmi_pb2.CapabilityResponse.SerializeToString,
+        ),
+        'Get': grpc.unary_unary_rpc_method_handler(
+            servicer.Get,
+            request_deserializer=gnmi_pb2.GetRequest.FromString,
+            response_serializer=gnmi_pb2.GetResponse.SerializeToString,
+        ),
+        'Set': grpc.unary_unary_rpc_method_handler(
+            servicer.Set,
+            request_deserializer=gnmi_pb2.SetRequest.FromString,
+            response_serializer=gnmi_pb2.SetResponse.SerializeToString,
+        ),
+        'Subscribe': grpc.stream_stream_rpc_method_handler(
+            servicer.Subscribe,
+            request_deserializer=gnmi_pb2.SubscribeRequest.FromString,
+            response_serializer=serialize_response,
+        ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+        'gnmi.gNMI', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    servicer.serialize_responses = True
 
 
 class AsyncGnmiService(gnmi_pb2_grpc.gNMIServicer):
@@ -46,6 +106,15 @@ class AsyncGnmiService(gnmi_pb2_grpc.gNMIServicer):
         )
         self.target_address = "{}:{}".format(
             args.target_host, args.target_port)
+        self.response_logger = ResponseLogger(
+            self.logger,
+            self.options.response_log_level,
+            self.options.response_log_sample,
+            self.options.response_log_summary
+        )
+        # set by add_gnmi_servicer_to_server once Subscribe responses go
+        # through serialize_response
+        self.serialize_responses = False
 
     async def Capabilities(self, request, context):
         """Capabilities allows the client to retrieve the set of capabilities that
@@ -77,9 +146,23 @@ class AsyncGnmiService(gnmi_pb2_grpc.gNMIServicer):
         """
         get_start = datetime.datetime.now()
         try:
-            context.set_code(grpc.StatusCode.UNIMPLEMENTED)
-            context.set_details('Method not implemented!')
-            raise NotImplementedError('Method not implemented!')
+            init, error = await TestManager.Instance().init_once_func(
+                self.options)
+            if init is False:
+                context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+                context.set_details(error)
+                return gnmi_pb2.GetResponse()
+
+            response, code, error = await TestManager.Instance().get_stats(
+                request)
+            if code != grpc.StatusCode.OK:
+                self.logger.error('Get failed: %s', error)
+                context.set_code(code)
+                context.set_details(error)
+                return gnmi_pb2.GetResponse()
+            context.set_code(grpc.StatusCode.OK)
+            context.set_details('Success!')
+            return response
         finally:
             self.profile_logger.info(
                 "Get completed!", extra={
@@ -138,6 +221,10 @@ class AsyncGnmiService(gnmi_pb2_grpc.gNMIServicer):
             # https://github.com/grpc/grpc/issues/23070
             # context.add_done_callback(TestManager.Instance().terminate(request_iterator))
             await TestManager.Instance().register_subscription(session)
+            await TestManager.Instance().start_request_reader(
+                session, request_iterator)
+            if session.mode == gnmi_pb2.SubscriptionList.Mode.ONCE:
+                await TestManager.Instance().once_session(session)
             self.logger.info(
                 'Starting polling stats for mode : %s',
                 get_subscription_mode_string(session.mode))
@@ -146,46 +233,40 @@ class AsyncGnmiService(gnmi_pb2_grpc.gNMIServicer):
             while await TestManager.Instance().keep_polling():
 
                 try:
+                    if session.mode == gnmi_pb2.SubscriptionList.Mode.POLL:
+                        # nothing is sent until the client polls, the stream
+                        # ends when the client closes its side
+                        if not await TestManager.Instance().wait_for_poll(
+                                session):
+                            break
+                        await TestManager.Instance().poll_session(session)
                     responses = await TestManager.Instance().publish_stats(
-                        session)
+                        session, self.serialize_responses)
                     for response in responses:
                         if response is not None:
-                            if response.HasField('update'):
-                                response_str = str(
-                                    response.SerializeToString())
-                                response_str = '{' + response_str.split(
-                                        '{', 1
-                                    )[1][:-1]
-                                response_str = response_str.replace(
-                                    "\\n", "")
-                                self.logger.info(
-                                    'Response[%s]: update - %s',
-                                    counter,
-                                    eval(response_str)
-                                )
-                            elif response.HasField('sync_response'):
-                                self.logger.info(
-                                    'Response[%s]: update - %s',
-                                    counter,
-                                    response.sync_response
-                                )
-                            else:
-                                self.logger.info(
-                                    'Response[%s]: %s', counter, response
-                                )
+                            self.response_logger.log(counter, response)
                             yield response
                     counter = counter + 1
-                    if (
-                        session.mode == gnmi_pb2.SubscriptionList.Mode.ONCE or
-                        session.mode == gnmi_pb2.SubscriptionList.Mode.POLL
-                        ) and \
-                            session.sent_sync is True:
+                    if session.mode == gnmi_pb2.SubscriptionList.Mode.ONCE \
+                            and session.sent_sync is True:
                         self.logger.info(
                             'Completed for %s, sync sent %s',
                             get_subscription_mode_string(session.mode),
                             session.sent_sync
                         )
                         break
+                    if session.mode == gnmi_pb2.SubscriptionList.Mode.POLL:
+                        continue
+
+                    # Sleep until the collectors publish a new sample instead
+                    # of re-sending the last one in a tight loop.
+                    await TestManager.Instance().wait_for_stats(session)
+
+                    if session.is_overflowed():
+                        self.logger.error(
+                            'Slow consumer, session queue overflowed. '
+                            'Peer %s', context.peer())
+                        break
 
                 except BaseException as innerEx:
                     self.logger.error('Exception: %s', str(innerEx))
@@ -198,6 +279,10 @@ class AsyncGnmiService(gnmi_pb2_grpc.gNMIServicer):
             await TestManager.Instance().deregister_subscription(session)
             await TestManager.Instance().remove_session(context)
 
+            if session.is_overflowed():
+                context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+                context.set_details('Slow consumer, session queue overflowed')
+                return
             context.set_code(grpc.StatusCode.OK)
             context.set_details('Success!')
 
@@ -0,0 +1,84 @@
+import argparse
+import time
+
+import snappi
+from otg_gnmi.common.serializer import (JsonSerializer, OrjsonSerializer,
+                                        orjson)
+
+'''
+Compares the JSON serializers on a metrics response of many flows:
+python3 -m tests.bench_serializer --flows 10000 --rounds 5
+'''
+
+
+def create_flow_metrics(flows):
+    api = snappi.api()
+    response = api.metrics_response()
+    for index in range(flows):
+        response.flow_metrics.metric(
+            name='Flow {}'.format(index),
+            port_tx='P1',
+            port_rx='P2',
+            transmit='started',
+            frames_tx=1000000 + index,
+            frames_rx=999000 + index,
+            bytes_tx=128000000 + index,
+            bytes_rx=127872000 + index,
+            frames_tx_rate=1000.5,
+            frames_rx_rate=999.25,
+            loss=0.1
+        )
+    return list(response.flow_metrics)
+
+
+def bench(name, serialize, metrics, rounds):
+    best = None
+    payloads = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        payloads = [serialize(metric) for metric in metrics]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    size = sum(len(payload) for payload in payloads)
+    print('{:<16} {:>10.1f} ms {:>12} bytes'.format(
+        name, best * 1000, size))
+    return payloads
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--flows', default=10000, type=int)
+    parser.add_argument('--rounds', default=5, type=int)
+    args = parser.parse_args()
+
+    metrics = create_flow_metrics(args.flows)
+    print('Serializing {} flow metrics, best of {} rounds'.format(
+        args.flows, args.rounds))
+    bench(
+        'snappi',
+        lambda metric: metric.serialize().encode('utf-8'),
+        metrics,
+        args.rounds
+    )
+    json_serializer = JsonSerializer()
+    expected = bench(
+        'json',
+        json_serializer.encode,
+        metrics,
+        args.rounds
+    )
+    if orjson is None:
+        print('orjson is not installed')
+        return
+    orjson_serializer = OrjsonSerializer()
+    payloads = bench(
+        'orjson',
+        orjson_serializer.encode,
+        metrics,
+        args.rounds
+    )
+    assert payloads == expected, 'orjson output differs from json'
+
+
+if __name__ == '__main__':
+    main()
@@ -100,11 +100,15 @@ class Session(object):
         result = True
         self.logger.info('Sending GetRequest')
         try:
-            request = gnmi_pb2.GetRequest()
+            request = gnmi_pb2.GetRequest(
+                path=[path_from_string(path) for path in self.options.paths],
+                encoding=self.options.encoding
+            )
             responses = self.stub.Get(request, metadata=self.options.metadata)
             self.logger.info('GetRequest Response: %s', responses)
             if responses is not None:
-                result = True
+                result = len(responses.notification) == len(
+                    self.options.paths)
 
         except KeyboardInterrupt:
             self.logger.info("Stopped by user")
@@ -133,7 +137,7 @@ class Session(object):
             updates = []
             updates.append(update)
             request = gnmi_pb2.SetRequest(update=updates)
-            responses = self.stub.Get(request, metadata=self.options.metadata)
+            responses = self.stub.Set(request, metadata=self.options.metadata)
             self.logger.info('SetRequest Response: %s', responses)
             if responses is not None:
                 result = True
@@ -94,6 +94,12 @@ def get_config():
                         headers={'Content-Type': 'application/json'})
 
 
+FLOW_METRIC_NAMES = [
+    'transmit', 'frames_tx', 'frames_rx', 'bytes_tx', 'bytes_rx',
+    'frames_tx_rate', 'frames_rx_rate'
+]
+
+
 @app.route('/results/metrics', methods=['POST'])
 def get_metrics():
     status = get_mockserver_status()
@@ -111,13 +117,33 @@ def get_metrics():
                     frames_rx=10000
                 )
         elif metrics_request.choice == 'flow':
+            metric_names = metrics_request.flow.metric_names
+            # like a real backend, only counters and rates can be selected
+            invalid = [
+                name for name in metric_names or []
+                if name not in FLOW_METRIC_NAMES
+            ]
+            if invalid:
+                return Response(status=400,
+                                response=json.dumps(
+                                    {'errors': ['invalid metric_names {}'
+                                                .format(invalid)]}),
+                                headers={'Content-Type': 'application/json'})
             for metric in CONFIG.flow_metrics:
+                columns = {
+                    'port_tx': "P1",
+                    'port_rx': "P2",
+                    'frames_tx': 10000,
+                    'frames_rx': 10000
+                }
+                if metric_names:
+                    columns = {
+                        column: value for column, value in columns.items()
+                        if column in metric_names
+                    }
                 metrics_response.flow_metrics.metric(
                     name=metric['name'],
-                    port_tx="P1",
-                    port_rx="P2",
-                    frames_tx=10000,
-                    frames_rx=10000
+                    **columns
                 )
 
         elif metrics_request.choice == 'bgpv4':
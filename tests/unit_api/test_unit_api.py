@@ -1,5 +1,24 @@
+import asyncio
+import logging
+import threading
+import time
+
+import grpc
 import pytest
-from tests.utils.common import init_gnmi_with_mock_server, get, set, capabilities, subscribe, change_mockserver_status# noqa
+import snappi
+from snappi import otg_pb2
+from otg_gnmi.autogen import gnmi_pb2
+from otg_gnmi.common import ixnutils
+from otg_gnmi.common.converter import get_converter
+from otg_gnmi.gnmi_serv_asyncio import serialize_response
+from otg_gnmi.common.deadband import ChangeDetector, parse_deadbands
+from otg_gnmi.common.api_pool import ApiPool, TimeoutHTTPAdapter, set_api_timeout # noqa
+from otg_gnmi.common.engine import CollectionEngine
+from otg_gnmi.common.response_logger import ResponseLogger
+from otg_gnmi.common.scheduler import AdaptiveInterval, TimerWheel
+from otg_gnmi.common.serializer import JsonSerializer, OrjsonSerializer, orjson # noqa
+from otg_gnmi.common.client_session import ClientSession, SessionQueue, POLICY_COALESCE, POLICY_DROP_OLDEST, POLICY_DISCONNECT, SLOW_CONSUMER_POLICIES # noqa
+from tests.utils.common import init_gnmi_with_mock_server, get, set, capabilities, subscribe, subscribe_once, subscribe_poll, subscribe_stream, create_subscribe_request, change_mockserver_status # noqa
 import json
 
 
@@ -199,12 +218,1011 @@ async def test_gnmi_server_set_api(snappiserver):
 async def test_gnmi_server_get_api(snappiserver):
     gnmi_api = init_gnmi_with_mock_server(200)
 
-    found_err = False
-    expected_err = 'Method not implemented!'
+    paths = ['/port_metrics[name=P1]', '/flow_metrics[name=F1]']
+    res, context = await get(gnmi_api, paths)
+    context.set_code.assert_called_with(grpc.StatusCode.OK)
+    names = [
+        notification.update[0].path.elem[0].key['name']
+        for notification in res.notification
+    ]
+    assert names == ['P1', 'F1']
+    stat = json.loads(res.notification[0].update[0].val.json_val)
+    assert stat['name'] == 'P1'
+
+    # served from the cache while younger than get_max_staleness
+    test_manager = ixnutils.TestManager.Instance()
+    res, context = await get(gnmi_api, ['/flow_metrics[name=F2]'])
+    sub = test_manager.get_subscriptions_cache['/flow_metrics[name:F2]']
+    sample = sub.sample
+    res, context = await get(gnmi_api, ['/flow_metrics[name=F2]'])
+    context.set_code.assert_called_with(grpc.StatusCode.OK)
+    assert sub.sample is sample
+
+    # evicted once too old to serve a Get
+    sub.last_polled -= test_manager.get_max_staleness + 1
+    test_manager.get_cache_swept -= test_manager.get_max_staleness
+    res, context = await get(gnmi_api, ['/flow_metrics[name=F1]'])
+    assert '/flow_metrics[name:F2]' not in test_manager.get_subscriptions_cache
+    assert '/flow_metrics[name:F1]' in test_manager.get_subscriptions_cache
+
+    res, context = await get(gnmi_api, ['/unknown_metrics[name=X]'])
+    context.set_code.assert_called_with(grpc.StatusCode.NOT_FOUND)
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_get_columns(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+
+    # leaves of a metric are fetched together, limited to their columns
+    paths = [
+        '/flow_metrics[name=F2]/frames_rx',
+        '/flow_metrics[name=F2]/frames_tx'
+    ]
+    res, context = await get(gnmi_api, paths)
+    context.set_code.assert_called_with(grpc.StatusCode.OK)
+    assert len(res.notification) == 2
+    for notification in res.notification:
+        stat = json.loads(notification.update[0].val.json_val)
+        assert stat['name'] == 'F2'
+        assert 'frames_rx' in stat and 'frames_tx' in stat
+        assert 'port_tx' not in stat
+
+    # any path wanting the whole metric fetches every column
+    test_manager = ixnutils.TestManager.Instance()
+    cache = test_manager.get_subscriptions_cache
+    leaf = cache['/flow_metrics[name:F2]/frames_rx']
+    assert leaf.subscribed_cols == ['frames_rx']
+    callback = test_manager.get_flow_metric
+    assert test_manager.get_stat_names(
+        callback, [leaf, cache['/flow_metrics[name:F2]/frames_tx']]
+    ) == ['frames_rx', 'frames_tx']
+    await get(gnmi_api, ['/flow_metrics[name=F2]'])
+    assert test_manager.get_stat_names(
+        callback, [leaf, cache['/flow_metrics[name:F2]']]) is None
+
+    # a leaf the request cannot select fetches every column too, instead of
+    # failing the whole batch
+    res, context = await get(gnmi_api, [
+        '/flow_metrics[name=F1]/frames_rx', '/flow_metrics[name=F1]/port_tx'
+    ])
+    context.set_code.assert_called_with(grpc.StatusCode.OK)
+    stat = json.loads(res.notification[1].update[0].val.json_val)
+    assert stat['port_tx'] == 'P1'
+    assert test_manager.get_stat_names(callback, [
+        cache['/flow_metrics[name:F1]/frames_rx'],
+        cache['/flow_metrics[name:F1]/port_tx']
+    ]) is None
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_collect_chunks(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    await get(gnmi_api, [
+        '/flow_metrics[name=F1]/frames_rx', '/flow_metrics[name=F2]/frames_rx'
+    ])
+    test_manager = ixnutils.TestManager.Instance()
+    subs = {
+        path: test_manager.get_subscriptions_cache[path]
+        for path in ['/flow_metrics[name:F1]/frames_rx',
+                     '/flow_metrics[name:F2]/frames_rx']
+    }
+
+    calls = []
+
+    def fetch(names, stat_names):
+        calls.append(names)
+        if 'F2' in names:
+            raise Exception('chunk failed')
+        return [
+            metric
+            for metric in test_manager.get_flow_metric(names, stat_names)
+            if metric.name in names
+        ]
+
+    # one request per chunk, an error only affects its own chunk
+    chunk_size = test_manager.fetch_chunk_size
+    test_manager.fetch_chunk_size = 1
     try:
-        await get(gnmi_api)
-    except Exception as e:
-        assert str(e) == expected_err
-        found_err = True
+        test_manager.collect_group(fetch, subs, 'Flow')
+    finally:
+        test_manager.fetch_chunk_size = chunk_size
+    assert sorted(calls) == [['F1'], ['F2']]
+    assert subs['/flow_metrics[name:F1]/frames_rx'].sample.error is None
+    assert subs['/flow_metrics[name:F2]/frames_rx'].sample.error == \
+        'chunk failed'
 
-    assert found_err, 'Exception should be raised'
+
+@pytest.mark.asyncio
+async def test_gnmi_server_subscribe_wildcard(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    requests = asyncio.Queue()
+    await requests.put(create_subscribe_request(['/flow_metrics[name=*]']))
+    responses = subscribe_stream(gnmi_api, requests)
+
+    # a single subscription fanned out into one update per flow
+    names = []
+    async for res in responses:
+        assert not res.HasField('error')
+        if res.HasField('sync_response'):
+            break
+        names.append(res.update.update[0].path.elem[0].key['name'])
+    assert sorted(names) == ['F1', 'F2']
+    test_manager = ixnutils.TestManager.Instance()
+    sub = test_manager.flow_subscriptions['/flow_metrics[name:*]']
+    assert sorted(sub.children.keys()) == [
+        '/flow_metrics[name:F1]', '/flow_metrics[name:F2]'
+    ]
+    await requests.put(None)
+    await responses.aclose()
+
+    res, context = await get(gnmi_api, ['/flow_metrics[name=*]'])
+    context.set_code.assert_called_with(grpc.StatusCode.OK)
+    assert sorted([
+        notification.update[0].path.elem[0].key['name']
+        for notification in res.notification
+    ]) == ['F1', 'F2']
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_subscribe_wildcard_prunes_keys(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    requests = asyncio.Queue()
+    request = create_subscribe_request(['/flow_metrics[name=*]'])
+    # no scheduled fetch during the test, only the one made below
+    request.subscribe.subscription[0].sample_interval = 60 * 10 ** 9
+    request.subscribe.subscription[0].heartbeat_interval = 0
+    await requests.put(request)
+    responses = subscribe_stream(gnmi_api, requests)
+    names = []
+    synced = False
+    async for res in responses:
+        synced = synced or res.HasField('sync_response')
+        names.extend(
+            update.path.elem[0].key['name'] for update in res.update.update)
+        if synced and sorted(names) == ['F1', 'F2']:
+            break
+    test_manager = ixnutils.TestManager.Instance()
+    path = '/flow_metrics[name:*]'
+    sub = test_manager.flow_subscriptions[path]
+    session = [
+        session for session in test_manager.client_sessions.values()
+        if path in session.subscriptions
+    ][0]
+    assert sorted(session.children) == [
+        '/flow_metrics[name:F1]', '/flow_metrics[name:F2]'
+    ]
+
+    def fetch(names, stat_names):
+        # F2 is gone from the backend
+        return [
+            metric
+            for metric in test_manager.get_flow_metric(names, stat_names)
+            if metric.name == 'F1'
+        ]
+
+    test_manager.collect_group(fetch, {path: sub}, 'Flow')
+    # the stream is idle in between, drain what the fetch queued
+    await test_manager.publish_stats(session)
+    # neither the wildcard nor the session keep the key and its sample
+    assert list(sub.children) == ['/flow_metrics[name:F1]']
+    assert list(session.children) == ['/flow_metrics[name:F1]']
+
+    await requests.put(None)
+    await responses.aclose()
+
+
+def test_proto_converter():
+    api = snappi.api()
+    metric = api.metrics_response().flow_metrics.metric(
+        name='F1', transmit='started', frames_tx=10, loss=0.5)[-1]
+    metric.metric_groups.metricgroup(name='vlan', value='100')
+    metric.timestamps.first_timestamp_ns = 1.5
+
+    message = get_converter(otg_pb2.FlowMetric).convert(metric)
+    assert message.name == 'F1'
+    assert message.transmit == otg_pb2.FlowMetric.Transmit.started
+    assert message.frames_tx == 10
+    assert message.loss == 0.5
+    assert not message.HasField('frames_rx')
+    assert message.metric_groups[0].value == '100'
+    assert message.timestamps.first_timestamp_ns == 1.5
+
+    # deltas are plain dicts of properties
+    message = get_converter(otg_pb2.FlowMetric).convert({'frames_tx': 20})
+    assert message.frames_tx == 20
+
+
+def test_serializer_matches_snappi():
+    api = snappi.api()
+    metrics = api.metrics_response().flow_metrics
+    metric = metrics.metric(
+        name='F1', transmit='started', frames_tx=10, loss=0.5)[-1]
+    metric.metric_groups.metricgroup(name='vlan', value='100')
+
+    # same document as snappi, int64 counters as strings, only compact
+    expected = json.loads(metric.serialize())
+    payload = JsonSerializer().encode(metric)
+    assert json.loads(payload) == expected
+    assert payload.startswith(b'{"frames_tx":"10",')
+    assert b' ' not in payload
+    assert json.loads(JsonSerializer().encode(
+        {'name': 'F1', 'frames_tx': '20'})) == {
+        'name': 'F1', 'frames_tx': '20'}
+
+    if orjson is None:
+        pytest.skip('orjson is not installed')
+    # byte for byte, whatever the magnitude of the floats
+    for value in [0.5, 1e-05, 1e-07, 0.1 + 0.2, 1e16, 1.5e300,
+                  float('inf')]:
+        metric = metrics.metric(name='F2', loss=value, frames_rx_rate=value)
+        metric = metric[-1]
+        assert OrjsonSerializer().encode(metric) == \
+            JsonSerializer().encode(metric)
+    assert OrjsonSerializer().encode({'loss': 1e-05}) == b'{"loss":1e-05}'
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_get_proto(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    res, context = await get(
+        gnmi_api,
+        ['/flow_metrics[name=F1]', '/bgpv4_metrics[name=BGPv4-2]'],
+        gnmi_pb2.Encoding.PROTO
+    )
+    context.set_code.assert_called_with(grpc.StatusCode.OK)
+    flow = otg_pb2.FlowMetric()
+    assert res.notification[0].update[0].val.any_val.Unpack(flow)
+    assert flow.name == 'F1'
+    assert flow.frames_rx == 10000
+    assert flow.port_tx == 'P1'
+    bgp = otg_pb2.Bgpv4Metric()
+    assert res.notification[1].update[0].val.any_val.Unpack(bgp)
+    assert bgp.name == 'BGPv4-2'
+    assert bgp.session_state == otg_pb2.Bgpv4Metric.SessionState.up
+    assert bgp.routes_advertised == 1000
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_subscribe_shared_paths(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    path = '/bgpv4_metrics[name:BGPv4-2]'
+    streams = []
+    for _ in range(2):
+        requests = asyncio.Queue()
+        await requests.put(
+            create_subscribe_request(['/bgpv4_metrics[name=BGPv4-2]']))
+        responses = subscribe_stream(gnmi_api, requests)
+        res = await responses.__anext__()
+        assert res.HasField('update')
+        streams.append((requests, responses))
+
+    # both sessions share one subscription, each holding one reference
+    test_manager = ixnutils.TestManager.Instance()
+    sub = test_manager.protocol_subscriptions[path]
+    assert sub.refcount == 2
+    sessions = [
+        session for session in test_manager.client_sessions.values()
+        if path in session.subscriptions
+    ]
+    assert len(sessions) == 2
+    for session in sessions:
+        assert session.subscriptions[path].sub is sub
+
+    # the path stays registered and collected for the remaining session
+    requests, responses = streams[0]
+    await requests.put(None)
+    await responses.aclose()
+    assert test_manager.protocol_subscriptions[path] is sub
+    assert sub.refcount == 1
+    generation = sub.generation
+    requests, responses = streams[1]
+    async for res in responses:
+        if res.HasField('update'):
+            break
+    assert sub.generation > generation
+
+    await requests.put(None)
+    await responses.aclose()
+    assert path not in test_manager.protocol_subscriptions
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_subscribe_batch_updates(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    # initialized ahead, the first request would reset batch_updates
+    await get(gnmi_api, ['/port_metrics[name=P1]'])
+    test_manager = ixnutils.TestManager.Instance()
+    test_manager.batch_updates = True
+    try:
+        responses = await subscribe_once(gnmi_api)
+    finally:
+        test_manager.batch_updates = False
+
+    # all updates of a cycle share a single notification and timestamp
+    assert len(responses) == 2
+    res_1 = responses[0]
+    assert res_1.HasField('update')
+    names = [
+        update.path.elem[0].key['name'] for update in res_1.update.update
+    ]
+    assert sorted(names) == sorted([
+        "P1", "P2", "F1", 'BGPv4-1', 'BGPv6-1', 'ISIS-1',
+        "p1d1eth1", "p1d2eth1"
+    ])
+    assert responses[1].HasField('sync_response')
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_batch_size_limit(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    await get(gnmi_api, ['/port_metrics[name=P1]'])
+    test_manager = ixnutils.TestManager.Instance()
+    updates = [
+        gnmi_pb2.Update(
+            path=gnmi_pb2.Path(elem=[gnmi_pb2.PathElem(
+                name='flow_metrics', key={'name': 'F{}'.format(index)})]),
+            val=gnmi_pb2.TypedValue(json_val=b'x' * (index % 300)))
+        for index in range(500)
+    ]
+    max_size = test_manager.max_notification_size
+    try:
+        for size in range(1000, 1100):
+            test_manager.max_notification_size = size
+            responses = test_manager.encode_batch(updates)
+            # framing and timestamp included, every response fits
+            for res in responses:
+                assert res.ByteSize() <= size
+            assert sum(len(res.update.update) for res in responses) == 500
+    finally:
+        test_manager.max_notification_size = max_size
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_encode_once_per_family(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    await get(gnmi_api, ['/port_metrics[name=P2]'])
+    test_manager = ixnutils.TestManager.Instance()
+    sub = test_manager.get_subscriptions_cache['/port_metrics[name:P2]']
+    sample = sub.sample
+
+    # JSON and JSON_IETF share the payload built for the sample
+    json_res = sub.encode_stats(gnmi_pb2.Encoding.JSON, sample=sample)
+    ietf_res = sub.encode_stats(gnmi_pb2.Encoding.JSON_IETF, sample=sample)
+    assert list(sample.payloads.keys()) == [('json', False)]
+    assert json_res.update.update[0].val.json_val == \
+        ietf_res.update.update[0].val.json_ietf_val
+    assert sub.encode_stats(gnmi_pb2.Encoding.JSON, sample=sample) is \
+        json_res
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_get_leaf_updates(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    test_manager = ixnutils.TestManager.Instance()
+    await get(gnmi_api, ['/port_metrics[name=P1]'])
+    test_manager.leaf_updates = True
+    try:
+        res, context = await get(gnmi_api, [
+            '/isis_metrics[name=ISIS-2]', '/port_metrics[name=P2]/frames_rx'
+        ])
+    finally:
+        test_manager.leaf_updates = False
+    context.set_code.assert_called_with(grpc.StatusCode.OK)
+
+    # one typed update per leaf, under the keyed path
+    isis = res.notification[0].update
+    assert len(isis) == 1
+    assert [elem.name for elem in isis[0].path.elem] == [
+        'isis_metrics', 'l1_sessions_up'
+    ]
+    assert isis[0].path.elem[0].key['name'] == 'ISIS-2'
+    assert isis[0].val.HasField('uint_val')
+
+    # a leaf subscription only gets its own leaf
+    port = res.notification[1].update
+    assert len(port) == 1
+    assert port[0].path.elem[0].key['name'] == 'P2'
+    assert port[0].path.elem[1].name == 'frames_rx'
+    assert port[0].val.uint_val == 10000
+
+    # the leaf paths are built once per subscription
+    sub = test_manager.get_subscriptions_cache[
+        '/port_metrics[name:P2]/frames_rx']
+    assert sub.get_leaf_path('frames_rx') is sub.get_leaf_path('frames_rx')
+
+
+def test_session_queue_slow_consumer_policies():
+    queue = SessionQueue(2, POLICY_COALESCE)
+    for sample in range(3):
+        queue.put('/port_metrics[name:P1]', sample)
+    queue.put('/port_metrics[name:P2]', 0)
+    queue.put('/flow_metrics[name:F1]', 0)
+    # only the latest sample of a path is kept, every path is
+    assert queue.drain() == [
+        ('/port_metrics[name:P1]', 2),
+        ('/port_metrics[name:P2]', 0),
+        ('/flow_metrics[name:F1]', 0)
+    ]
+    assert queue.coalesced == 2
+    assert queue.dropped == 0
+
+    queue = SessionQueue(2, POLICY_DROP_OLDEST)
+    for sample in range(3):
+        queue.put('/port_metrics[name:P1]', sample)
+    assert queue.drain() == [
+        ('/port_metrics[name:P1]', 1),
+        ('/port_metrics[name:P1]', 2)
+    ]
+    assert queue.dropped == 1
+    assert not queue.overflowed
+
+    queue = SessionQueue(2, POLICY_DISCONNECT)
+    for sample in range(5):
+        queue.put('/port_metrics[name:P1]', sample)
+    assert queue.overflowed
+    # the session is going away, its queue stops growing
+    assert len(queue) == 3
+    assert queue.dropped == 2
+
+    # the limit applies to the samples of each path, e.g. the keys of a
+    # wildcard, not to the number of paths
+    for policy in SLOW_CONSUMER_POLICIES:
+        queue = SessionQueue(2, policy)
+        for sample in range(2):
+            for index in range(10):
+                queue.put('/flow_metrics[name:F{}]'.format(index), sample)
+        assert len(queue) == (10 if policy == POLICY_COALESCE else 20)
+        assert queue.dropped == 0
+        assert not queue.overflowed
+        assert len({path for path, _ in queue.drain()}) == 10
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def create_logged_response(name):
+    path = gnmi_pb2.Path(elem=[
+        gnmi_pb2.PathElem(name='port_metrics', key={'name': name})
+    ])
+    update = gnmi_pb2.Update(
+        path=path, val=gnmi_pb2.TypedValue(json_val=b'{"name":"P1"}'))
+    return gnmi_pb2.SubscribeResponse(
+        update=gnmi_pb2.Notification(update=[update]))
+
+
+def test_response_logger():
+    logger = logging.getLogger('test-response-logger')
+    logger.propagate = False
+    handler = ListHandler()
+    logger.addHandler(handler)
+    try:
+        # a disabled level never looks at the response, not even bytes
+        # that would fail to parse
+        logger.setLevel(logging.INFO)
+        ResponseLogger(logger, logging.DEBUG).log(0, b'not a response')
+        assert handler.messages == []
+
+        # 1 in N responses logged, bytes of the pass-through serializer
+        # parsed when formatted
+        response_logger = ResponseLogger(logger, logging.INFO, 3)
+        for index in range(7):
+            response_logger.log(
+                index, create_logged_response('P1').SerializeToString())
+        assert handler.messages == [
+            'Response[2]: update - /port_metrics[name=P1]: {"name":"P1"}',
+            'Response[5]: update - /port_metrics[name=P1]: {"name":"P1"}'
+        ]
+
+        # per path counts, flushed once summary_interval elapsed
+        handler.messages = []
+        response_logger = ResponseLogger(
+            logger, logging.INFO, summary_interval=60)
+        response_logger.log(0, create_logged_response('P1'))
+        response_logger.log(1, create_logged_response('P2'))
+        assert handler.messages == []
+        response_logger.last_summary -= 60
+        response_logger.log(2, create_logged_response('P1'))
+        assert len(handler.messages) == 2
+        assert handler.messages[0].endswith('/port_metrics[name=P1] - 2')
+        assert handler.messages[1].endswith('/port_metrics[name=P2] - 1')
+        assert response_logger.summary == {}
+    finally:
+        logger.removeHandler(handler)
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_publish_serialized(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    await get(gnmi_api, ['/port_metrics[name=P1]'])
+    test_manager = ixnutils.TestManager.Instance()
+    request = create_subscribe_request(['/bgpv4_metrics[name=BGPv4-1]'])
+    subscriptionList = request.subscribe
+    subscription = subscriptionList.subscription[0]
+    sub = ixnutils.SubscriptionReq(subscription)
+    sessions = []
+    for _ in range(2):
+        session = ClientSession(None, None)
+        session_sub = ixnutils.SessionSubscription(
+            sub, session, subscriptionList, subscription)
+        session.register_path(sub.stringpath, session_sub)
+        sub.add_subscriber(session_sub)
+        sessions.append(session)
+
+    metric = snappi.api().metrics_response().bgpv4_metrics.metric(
+        name='BGPv4-1', session_state='up')[-1]
+    sub.update_stats(metric)
+    results = []
+    for session in sessions:
+        session.enqueue(sub.stringpath, sub.sample)
+        results.append(
+            await test_manager.publish_stats(session, serialized=True))
+
+    # the update is serialized once, the very same bytes go to every
+    # stream, the sync_response stays a message
+    for responses in results:
+        assert len(responses) == 2
+        assert isinstance(responses[1], gnmi_pb2.SubscribeResponse)
+        assert responses[1].sync_response
+    update = results[0][0]
+    assert isinstance(update, bytes)
+    assert results[1][0] is update
+    res = gnmi_pb2.SubscribeResponse.FromString(update)
+    assert res.update.update[0].path.elem[0].key['name'] == 'BGPv4-1'
+
+    sub.update_error('backend down')
+    for session in sessions:
+        session.enqueue(sub.stringpath, sub.sample)
+        responses = await test_manager.publish_stats(session, serialized=True)
+        assert len(responses) == 1
+        assert isinstance(responses[0], gnmi_pb2.SubscribeResponse)
+        assert responses[0].error.message == 'BGPv4-1: backend down'
+
+    # bytes are written as is, messages serialized
+    assert serialize_response(update) is update
+    assert serialize_response(res) == update
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_on_change_coalesced(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    await get(gnmi_api, ['/port_metrics[name=P1]'])
+    test_manager = ixnutils.TestManager.Instance()
+    request = create_subscribe_request(['/bgpv4_metrics[name=BGPv4-1]'])
+    subscriptionList = request.subscribe
+    subscription = subscriptionList.subscription[0]
+    subscription.mode = gnmi_pb2.SubscriptionMode.ON_CHANGE
+    subscription.heartbeat_interval = 0
+    sub = ixnutils.SubscriptionReq(subscription)
+    session = ClientSession(None, None)
+    session_sub = ixnutils.SessionSubscription(
+        sub, session, subscriptionList, subscription)
+    session.register_path(sub.stringpath, session_sub)
+    sub.add_subscriber(session_sub)
+
+    def collect(state):
+        metric = snappi.api().metrics_response().bgpv4_metrics.metric(
+            name='BGPv4-1', session_state=state)[-1]
+        sub.update_stats(metric)
+        session.enqueue(sub.stringpath, sub.sample)
+
+    def get_updates(responses):
+        return [
+            json.loads(res.update.update[0].val.json_val)
+            for res in responses if res.HasField('update')
+        ]
+
+    collect('up')
+    assert get_updates(await test_manager.publish_stats(session)) == [
+        {'name': 'BGPv4-1', 'session_state': 'up'}
+    ]
+
+    # the sample changing the state is replaced by one without changes
+    # before the session gets to it, the state is sent all the same
+    collect('down')
+    collect('down')
+    assert len(session.queue) == 1
+    assert get_updates(await test_manager.publish_stats(session)) == [
+        {'name': 'BGPv4-1', 'session_state': 'down'}
+    ]
+
+    # back to deltas once in step
+    collect('down')
+    assert get_updates(await test_manager.publish_stats(session)) == []
+    collect('up')
+    assert get_updates(await test_manager.publish_stats(session)) == [
+        {'session_state': 'up'}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_subscribe_poll(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    responses = await subscribe_poll(gnmi_api, polls=2)
+
+    # the initial snapshot and every Poll are answered with fresh updates
+    # followed by a sync_response, then the stream ends with the requests
+    syncs = [
+        index for index, res in enumerate(responses)
+        if res.HasField('sync_response')
+    ]
+    assert len(syncs) == 3
+    assert syncs[-1] == len(responses) - 1
+    start = 0
+    for sync in syncs:
+        assert sync > start
+        for res in responses[start:sync]:
+            assert res.HasField('update') or res.HasField('error')
+        start = sync + 1
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_subscribe_once(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    responses = await subscribe_once(gnmi_api)
+
+    # answered right away with every path then a single sync_response
+    assert responses[-1].HasField('sync_response')
+    names = []
+    for res in responses[:-1]:
+        assert res.HasField('update')
+        names.append(res.update.update[0].path.elem[0].key['name'])
+    assert sorted(names) == sorted([
+        "P1", "P2", "F1", 'BGPv4-1', 'BGPv6-1', 'ISIS-1',
+        "p1d1eth1", "p1d2eth1"
+    ])
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_subscribe_once_max_staleness(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    paths = ['/bgpv6_metrics[name=BGPv6-2]']
+    stream_requests = asyncio.Queue()
+    request = create_subscribe_request(paths)
+    request.subscribe.subscription[0].sample_interval = 60 * 10 ** 9
+    await stream_requests.put(request)
+    stream = subscribe_stream(gnmi_api, stream_requests)
+    res = await stream.__anext__()
+    assert res.HasField('update')
+    test_manager = ixnutils.TestManager.Instance()
+    sub = test_manager.protocol_subscriptions['/bgpv6_metrics[name:BGPv6-2]']
+
+    async def subscribe_paths_once():
+        requests = asyncio.Queue()
+        request = create_subscribe_request(paths)
+        request.subscribe.mode = gnmi_pb2.SubscriptionList.Mode.ONCE
+        await requests.put(request)
+        await requests.put(None)
+        responses = subscribe_stream(gnmi_api, requests)
+        return [res async for res in responses]
+
+    # like Get, served from a sample younger than get_max_staleness
+    generation = sub.generation
+    responses = await subscribe_paths_once()
+    assert responses[0].HasField('update')
+    assert responses[-1].HasField('sync_response')
+    assert sub.generation == generation
+
+    max_staleness = test_manager.get_max_staleness
+    test_manager.get_max_staleness = 0
+    try:
+        responses = await subscribe_paths_once()
+    finally:
+        test_manager.get_max_staleness = max_staleness
+    assert responses[-1].HasField('sync_response')
+    assert sub.generation == generation + 1
+
+    await stream_requests.put(None)
+    await stream.aclose()
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_subscribe_update_paths(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    requests = asyncio.Queue()
+    await requests.put(create_subscribe_request(['/port_metrics[name=P1]']))
+    responses = subscribe_stream(gnmi_api, requests)
+
+    def get_name(res):
+        return res.update.update[0].path.elem[0].key['name']
+
+    res = await responses.__anext__()
+    assert get_name(res) == 'P1'
+
+    # swap P1 for F1 without closing the stream
+    await requests.put(create_subscribe_request(['/flow_metrics[name=F1]']))
+    flow_updates = 0
+    async for res in responses:
+        if not res.HasField('update'):
+            continue
+        if flow_updates > 0:
+            assert get_name(res) == 'F1'
+        if get_name(res) == 'F1':
+            flow_updates += 1
+            if flow_updates == 2:
+                break
+
+    test_manager = ixnutils.TestManager.Instance()
+    sessions = [
+        session for session in test_manager.client_sessions.values()
+        if '/flow_metrics[name:F1]' in session.subscriptions
+    ]
+    assert len(sessions) == 1
+    assert list(sessions[0].subscriptions) == ['/flow_metrics[name:F1]']
+
+    await requests.put(None)
+    await responses.aclose()
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_subscribe_first_update_out_of_cycle(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    requests = asyncio.Queue()
+    request = create_subscribe_request(['/flow_metrics[name=F2]'])
+    # far longer than the test, only the out of cycle fetch can answer
+    request.subscribe.subscription[0].sample_interval = 60 * 10 ** 9
+    await requests.put(request)
+    start = time.time()
+    responses = subscribe_stream(gnmi_api, requests)
+
+    res = await responses.__anext__()
+    assert res.update.update[0].path.elem[0].key['name'] == 'F2'
+    res = await responses.__anext__()
+    assert res.HasField('sync_response')
+    assert time.time() - start < 2
+
+    # a single backend round trip answered the new path
+    test_manager = ixnutils.TestManager.Instance()
+    sub = test_manager.flow_subscriptions['/flow_metrics[name:F2]']
+    assert sub.generation == 1
+
+    await requests.put(None)
+    await responses.aclose()
+
+
+def test_collection_engine_schedules_kinds():
+    collected = []
+    lock = threading.Lock()
+    engine = CollectionEngine(
+        lambda subscriptions, name: collected.append(
+            (name, list(subscriptions))),
+        lock,
+        2,
+        0.01,
+        logging.getLogger('test')
+    )
+    engine.register_kind(
+        'port', 'Port', {'/port_metrics[name:P1]': None}, 1, 0.01, 4)
+    engine.register_kind('flow', 'Flow', {}, 1, 0.01, 4)
+    engine.start()
+    try:
+        lock.acquire()
+        engine.schedule('port', '/port_metrics[name:P1]', 0.05)
+        lock.release()
+        time.sleep(0.3)
+    finally:
+        engine.stop()
+
+    # only the scheduled kind is fetched, once per interval
+    assert 3 <= len(collected) <= 7
+    for name, paths in collected:
+        assert name == 'Port'
+        assert paths == ['/port_metrics[name:P1]']
+
+
+def test_timer_wheel_aligns_intervals():
+    wheel = TimerWheel(0.01)
+    wheel.add('/port_metrics[name:P1]', 0.1, 0)
+    wheel.add('/port_metrics[name:P2]', 1, 0)
+
+    # mid tick times, clear of float rounding at the tick boundaries
+    due = {}
+    for tick in range(201):
+        members = wheel.pop_due((tick + 0.5) * 0.01)
+        if len(members) > 0:
+            due[tick] = members
+    assert sorted(due) == list(range(10, 201, 10))
+    for tick, members in due.items():
+        if tick % 100 == 0:
+            # the 1s member comes due along with the 100ms one
+            assert members == {
+                '/port_metrics[name:P1]', '/port_metrics[name:P2]'}
+        else:
+            assert members == {'/port_metrics[name:P1]'}
+
+    # so the collector issues one fetch per due tick
+    fetches = []
+    lock = threading.Lock()
+    engine = CollectionEngine(
+        lambda subscriptions, name: fetches.append(sorted(subscriptions)),
+        lock,
+        1,
+        0.01,
+        logging.getLogger('test')
+    )
+    engine.register_kind('port', 'Port', {
+        '/port_metrics[name:P1]': None, '/port_metrics[name:P2]': None
+    }, 1, 0.01, 4)
+    engine.start()
+    try:
+        lock.acquire()
+        engine.schedule('port', '/port_metrics[name:P1]', 0.05)
+        engine.schedule('port', '/port_metrics[name:P2]', 0.1)
+        lock.release()
+        time.sleep(0.32)
+    finally:
+        engine.stop()
+    assert 4 <= len(fetches) <= 7
+    assert ['/port_metrics[name:P2]'] not in fetches
+    assert fetches.count(
+        ['/port_metrics[name:P1]', '/port_metrics[name:P2]']) >= 2
+
+
+def test_api_pool_reuses_clients():
+    created = []
+
+    def create():
+        created.append(object())
+        return created[-1]
+
+    pool = ApiPool(create, 2)
+    with pool.acquire() as api_1:
+        with pool.acquire() as api_2:
+            assert api_1 is not api_2
+    # idle clients are reused, never more than size are created
+    for _ in range(3):
+        with pool.acquire() as api:
+            assert api in created
+    assert len(created) == 2
+
+    released = threading.Event()
+
+    def hold():
+        with pool.acquire():
+            with pool.acquire():
+                released.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    time.sleep(0.1)
+    waiter = threading.Thread(target=lambda: pool.acquire().__enter__())
+    waiter.start()
+    waiter.join(0.2)
+    # all clients busy, the next request waits for one
+    assert waiter.is_alive()
+    released.set()
+    holder.join()
+    waiter.join(1)
+    assert not waiter.is_alive()
+    assert len(created) == 2
+
+
+def test_api_timeout_adapter():
+    api = snappi.api(location='http://127.0.0.1:11020')
+    assert set_api_timeout(api, 5) is True
+    adapter = api._transport._session.get_adapter('http://127.0.0.1:11020')
+    assert isinstance(adapter, TimeoutHTTPAdapter)
+    assert adapter.timeout == 5
+    assert set_api_timeout(object(), 5) is False
+
+
+def test_adaptive_interval_follows_latency():
+    interval = AdaptiveInterval(4, 0.05, 4, headroom=4)
+    assert interval.interval == 4
+
+    # a fast backend tightens the interval down to the floor
+    assert interval.record(0.001) is True
+    assert interval.interval == 0.05
+    assert interval.record(0.001) is False
+
+    # a slow one backs it off, progressively, up to the ceiling
+    assert interval.record(0.5) is True
+    assert 0.05 < interval.interval < 2
+    for _ in range(20):
+        interval.record(2)
+    assert interval.interval == 4
+
+
+def test_collection_engine_adapts_interval():
+    changed = []
+    lock = threading.Lock()
+    engine = CollectionEngine(
+        lambda subscriptions, name: None,
+        lock,
+        1,
+        0.01,
+        logging.getLogger('test'),
+        on_interval_change=changed.append
+    )
+    engine.register_kind(
+        'port', 'Port', {'/port_metrics[name:P1]': None}, 1, 0.05, 4)
+    engine.start()
+    try:
+        lock.acquire()
+        engine.schedule('port', '/port_metrics[name:P1]', 0.05)
+        lock.release()
+        time.sleep(0.2)
+    finally:
+        engine.stop()
+
+    # a backend answering instantly brings the kind to its floor
+    assert changed == ['port']
+    assert engine.get_interval('port') == 0.05
+
+
+def test_change_detector_deadbands():
+    types = snappi.api().metrics_response().flow_metrics.metric()[-1]._TYPES
+    detector = ChangeDetector(parse_deadbands(['loss=0.5', '*=10%']))
+    sample = {'name': 'F1', 'loss': 1.0, 'frames_rx_rate': 100.0}
+    assert detector.compute_delta(sample, types, 0) == sample
+
+    # changes within the dead-bands are held back, drifts add up
+    assert detector.compute_delta(
+        {'name': 'F1', 'loss': 1.3, 'frames_rx_rate': 105.0}, types, 1) == {}
+    assert detector.compute_delta(
+        {'name': 'F1', 'loss': 1.6, 'frames_rx_rate': 111.0}, types, 2) == {
+        'loss': 1.6, 'frames_rx_rate': 111.0}
+
+    # counters growing at a steady rate are left out
+    detector = ChangeDetector(counter_rate=True)
+    deltas = [
+        detector.compute_delta({'name': 'F1', 'frames_rx': frames}, types, t)
+        for t, frames in enumerate([0, 100, 200, 300, 500, 700, 10])
+    ]
+    assert deltas == [
+        {'name': 'F1', 'frames_rx': 0},
+        {'frames_rx': 100},
+        {},
+        {},
+        {'frames_rx': 500},
+        {},
+        {'frames_rx': 10}
+    ]
+
+    # fetch time jitter alone is not a rate change
+    detector = ChangeDetector(counter_rate=True)
+    jitter = [0, 0.01, -0.01, 0.008, -0.006, 0.01, -0.01, 0.004]
+    reported = [
+        len(detector.compute_delta(
+            {'frames_rx': 1000 * t}, types, t + jitter[t]))
+        for t in range(8)
+    ]
+    assert reported == [1, 1, 0, 0, 0, 0, 0, 0]
+    assert detector.compute_delta(
+        {'frames_rx': 9000}, types, 8) == {'frames_rx': 9000}
+
+    with pytest.raises(Exception):
+        parse_deadbands(['loss'])
+
+
+@pytest.mark.asyncio
+async def test_gnmi_server_subscribe_mixed_protocols(snappiserver):
+    gnmi_api = init_gnmi_with_mock_server(200)
+    requests = asyncio.Queue()
+    await requests.put(create_subscribe_request([
+        '/bgpv4_metrics[name=BGPv4-2]',
+        '/bgpv6_metrics[name=BGPv6-2]',
+        '/isis_metrics[name=ISIS-2]'
+    ]))
+    responses = subscribe_stream(gnmi_api, requests)
+
+    # every protocol name is collected from the API of its own choice,
+    # initially and on every scheduled cycle
+    names = []
+    async for res in responses:
+        assert not res.HasField('error')
+        if res.HasField('update'):
+            names.append(res.update.update[0].path.elem[0].key['name'])
+        if len(names) == 6:
+            break
+    assert sorted(names) == [
+        'BGPv4-2', 'BGPv4-2', 'BGPv6-2', 'BGPv6-2', 'ISIS-2', 'ISIS-2'
+    ]
+
+    await requests.put(None)
+    await responses.aclose()
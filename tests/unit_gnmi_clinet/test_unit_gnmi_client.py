@@ -18,7 +18,7 @@ def test_get(snappiserver):
         session = create_new_session()
         change_mockserver_status(200, False)
         result = session.get()
-        assert(result is False)
+        assert(result is True)
     finally:
         kill_gnmi_server(gnmi_server)
 
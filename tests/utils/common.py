@@ -10,7 +10,8 @@ from google.protobuf import json_format
 from otg_gnmi.autogen import gnmi_pb2
 from otg_gnmi.gnmi_serv_asyncio import AsyncGnmiService
 from tests.session import Session
-from tests.utils.client_utils import generate_subscription_request
+from tests.utils.client_utils import (generate_subscription_request,
+                                      path_from_string)
 from tests.utils.settings import GnmiSettings
 
 SETTINGS_FILE = 'settings.json'
@@ -147,6 +148,102 @@ def get_parsed_args(op_val):
                         help='path to certificate key, default is server.crt',
                         default='server.crt',
                         type=str)
+    parser.add_argument('--log-level',
+                        help='server log level',
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='info',
+                        type=str)
+    parser.add_argument('--response-log-level',
+                        help='level at which Subscribe responses are logged',
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='debug',
+                        type=str)
+    parser.add_argument('--response-log-sample',
+                        help='log only 1 in N Subscribe responses',
+                        default=1,
+                        type=int)
+    parser.add_argument('--response-log-summary',
+                        help='log a per path summary of responses every N '
+                             'seconds instead of the responses themselves',
+                        default=0,
+                        type=float)
+    parser.add_argument('--batch-updates',
+                        help='pack all updates of a sample into one '
+                             'notification per session',
+                        action='store_true')
+    parser.add_argument('--max-notification-size',
+                        help='max size in bytes of a batched notification',
+                        default=4*1024*1024,
+                        type=int)
+    parser.add_argument('--session-queue-size',
+                        help='max pending samples per path of a client '
+                             'session',
+                        default=1000,
+                        type=int)
+    parser.add_argument('--slow-consumer-policy',
+                        help='what to do when a session queue is full',
+                        choices=['coalesce', 'drop-oldest', 'disconnect'],
+                        default='coalesce',
+                        type=str)
+    parser.add_argument('--get-max-staleness',
+                        help='max age in seconds of a cached sample '
+                             'served by Get or a ONCE subscription',
+                        default=1.0,
+                        type=float)
+    parser.add_argument('--collector-workers',
+                        help='max concurrent backend fetches',
+                        default=4,
+                        type=int)
+    parser.add_argument('--min-poll-interval',
+                        help='floor in seconds of the adaptive interval '
+                             'of target defined subscriptions',
+                        default=0.05,
+                        type=float)
+    parser.add_argument('--max-poll-interval',
+                        help='ceiling in seconds of the adaptive interval '
+                             'of target defined subscriptions',
+                        default=4.0,
+                        type=float)
+    parser.add_argument('--fetch-chunk-size',
+                        help='max names per backend request, 0 for no limit',
+                        default=1000,
+                        type=int)
+    parser.add_argument('--fetch-max-inflight',
+                        help='max concurrent backend requests for the '
+                             'chunks of large batches',
+                        default=4,
+                        type=int)
+    parser.add_argument('--backend-pool-size',
+                        help='max backend clients, each with its own '
+                             'kept-alive connection',
+                        default=4,
+                        type=int)
+    parser.add_argument('--backend-timeout',
+                        help='timeout in seconds of backend requests, '
+                             '0 for none',
+                        default=30.0,
+                        type=float)
+    parser.add_argument('--leaf-updates',
+                        help='send one typed update per metric leaf '
+                             'instead of the whole metric as one value',
+                        action='store_true')
+    parser.add_argument('--deadband',
+                        help='FIELD=VALUE or FIELD=VALUE%%, smallest change '
+                             'of a metric field sent ON_CHANGE, * for every '
+                             'field, may be repeated',
+                        action='append',
+                        default=[],
+                        type=str)
+    parser.add_argument('--counter-rate-change',
+                        help='send counters ON_CHANGE only when their rate '
+                             'changes',
+                        action='store_true')
+    parser.add_argument('--counter-rate-tolerance',
+                        help='percent by which the rate of a counter '
+                             'without its own dead-band has to change to be '
+                             'sent with --counter-rate-change',
+                        default=5.0,
+                        type=float)
 
     arg_inputs = []
     for op, val in list(op_val.items()):
@@ -227,13 +324,19 @@ async def set(api):
     return results
 
 
-async def get(api):
+async def get(api, paths=None, encoding=None):
     print('Get gNMI Request......')
-    request = gnmi_pb2.GetRequest()
+    if paths is None:
+        paths = OPTIONS.paths
+    if encoding is None:
+        encoding = OPTIONS.encoding
+    request = gnmi_pb2.GetRequest(
+        path=[path_from_string(path) for path in paths],
+        encoding=encoding
+    )
     mock_context = mock.create_autospec(spec=grpc.aio.ServicerContext)
     response = await api.Get(request, mock_context)
-    results = [x async for x in response]
-    return results
+    return response, mock_context
 
 
 async def capabilities(api):
@@ -261,6 +364,64 @@ async def subscribe(api):
     return response_list
 
 
+def generate_mode_requests(mode, polls=0):
+    default_mode = OPTIONS.mode
+    OPTIONS.mode = mode
+    try:
+        yield from generate_subscription_request(OPTIONS)
+    finally:
+        OPTIONS.mode = default_mode
+    for _ in range(polls):
+        yield gnmi_pb2.SubscribeRequest(poll=gnmi_pb2.Poll())
+
+
+async def subscribe_poll(api, polls=1):
+    print('subscribe POLL gNMI Request......')
+    request_iterator = generate_mode_requests(
+        gnmi_pb2.SubscriptionList.Mode.POLL, polls)
+    mock_context = mock.create_autospec(spec=grpc.aio.ServicerContext)
+    mock_context.metadata = OPTIONS.metadata
+    responses = api.Subscribe(request_iterator, mock_context)
+    return [response async for response in responses]
+
+
+async def subscribe_once(api):
+    print('subscribe ONCE gNMI Request......')
+    request_iterator = generate_mode_requests(
+        gnmi_pb2.SubscriptionList.Mode.ONCE)
+    mock_context = mock.create_autospec(spec=grpc.aio.ServicerContext)
+    mock_context.metadata = OPTIONS.metadata
+    responses = api.Subscribe(request_iterator, mock_context)
+    return [response async for response in responses]
+
+
+def create_subscribe_request(paths):
+    default_paths = OPTIONS.paths
+    OPTIONS.paths = paths
+    try:
+        return next(generate_subscription_request(OPTIONS))
+    finally:
+        OPTIONS.paths = default_paths
+
+
+async def generate_queued_requests(queue):
+    while True:
+        request = await queue.get()
+        if request is None:
+            return
+        yield request
+
+
+def subscribe_stream(api, queue):
+    """Subscribe fed from an asyncio.Queue, the requests put on the queue
+    after the first one reach the server on the live stream.
+    """
+    print('subscribe STREAM gNMI Request......')
+    mock_context = mock.create_autospec(spec=grpc.aio.ServicerContext)
+    mock_context.metadata = OPTIONS.metadata
+    return api.Subscribe(generate_queued_requests(queue), mock_context)
+
+
 def create_new_session(wait_for_responses=3):
     print("Spawning new gNMI client...")
     session = Session()